@@ -0,0 +1,194 @@
+import asyncio
+import multiprocessing.util
+from collections import OrderedDict
+from collections.abc import AsyncIterator
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import chess
+import chess.engine
+import chess.polyglot
+from ircbot.utils import debug, log
+
+MATE_SCORE = 10_000
+CLAMP = 1_500  # centipawns, so lost positions don't count as huge blunders
+INACCURACY, MISTAKE, BLUNDER = 50, 100, 300
+
+# Engine of the current pool worker process
+_engine = None
+
+
+def _start_worker(path: str, options: dict):
+    global _engine
+    _engine = chess.engine.SimpleEngine.popen_uci(path)
+    _engine.configure({k: v for k, v in options.items() if k in _engine.options})
+    # Quit before the worker waits for the engine's thread on exit
+    multiprocessing.util.Finalize(None, _engine.quit, exitpriority=10)
+
+
+def _evaluate(fen: str, depth: int) -> int:
+    """Centipawns from white's point of view. Runs in a pool worker."""
+    info = _engine.analyse(chess.Board(fen), chess.engine.Limit(depth=depth))
+    return info["score"].white().score(mate_score=MATE_SCORE)
+
+
+class Analyzer:
+    def __init__(
+        self,
+        path: str,
+        workers: int = 1,
+        depth: int = 12,
+        options: dict | None = None,
+        cache_size: int = 100_000,
+    ):
+        """Evaluates every position of a game in a pool of processes, each
+        with its own stockfish, so analysis never competes with the engine
+        pool answering CPU moves. Evaluations are cached by zobrist hash.
+
+        :param path: Path to the stockfish binary.
+        :param workers: Number of processes.
+        :param depth: Search depth of each evaluation.
+        :param options: UCI options for the engines.
+        :param cache_size: Maximum number of evaluations kept.
+        """
+        self.path = path
+        self.workers = max(1, workers)
+        self.depth = depth
+        self.options = options or {}
+        self.cache_size = cache_size
+        self.cache: OrderedDict[int, int] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self._pool = None
+
+    def _executor(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            log(f"Starting {self.workers} analysis workers")
+            self._pool = ProcessPoolExecutor(
+                self.workers,
+                initializer=_start_worker,
+                initargs=(self.path, self.options),
+            )
+        return self._pool
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    async def evaluate(self, board: chess.Board) -> int:
+        key = chess.polyglot.zobrist_hash(board)
+        if key in self.cache:
+            self.cache.move_to_end(key)
+            self.hits += 1
+            return self.cache[key]
+        self.misses += 1
+        loop = asyncio.get_running_loop()
+        try:
+            score = await loop.run_in_executor(
+                self._executor(), _evaluate, board.fen(), self.depth
+            )
+        except BrokenProcessPool:
+            log("Analysis pool broke, restarting it")
+            self.close()
+            raise
+        self.cache[key] = score
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return score
+
+    async def judge(self, moves: list[str]) -> AsyncIterator["Judgement"]:
+        """Judges every move of a game played from the initial position, in
+        order, each as soon as the positions around it are evaluated."""
+        board = chess.Board()
+        hashes = [chess.polyglot.zobrist_hash(board)]
+        # Repeated positions are only evaluated once
+        tasks = {hashes[0]: asyncio.ensure_future(self.evaluate(board.copy()))}
+        for uci in moves:
+            board.push_uci(uci)
+            key = chess.polyglot.zobrist_hash(board)
+            hashes.append(key)
+            if key not in tasks:
+                tasks[key] = asyncio.ensure_future(
+                    self.evaluate(board.copy(stack=False))
+                )
+        try:
+            board = chess.Board()
+            before = await tasks[hashes[0]]
+            for n, uci in enumerate(moves):
+                move = chess.Move.from_uci(uci)
+                after = await tasks[hashes[n + 1]]
+                yield Judgement(n, board.san(move), board.turn, before, after)
+                board.push(move)
+                before = after
+            debug(f"Analysed {len(tasks)} positions")
+        finally:
+            for task in tasks.values():
+                task.cancel()
+            # Retrieves the errors of the positions nobody awaited
+            await asyncio.gather(*tasks.values(), return_exceptions=True)
+
+    async def analyze(self, moves: list[str]) -> list["Judgement"]:
+        """Judges every move of a game played from the initial position."""
+        return [judgement async for judgement in self.judge(moves)]
+
+
+class Judgement:
+    __slots__ = ("ply", "san", "color", "before", "after")
+
+    def __init__(self, ply, san, color, before, after):
+        self.ply = ply
+        self.san = san
+        self.color = color
+        self.before = before
+        self.after = after
+
+    @property
+    def loss(self) -> int:
+        """Centipawns the move gave away, from the mover's point of view."""
+        before = max(-CLAMP, min(CLAMP, self.before))
+        after = max(-CLAMP, min(CLAMP, self.after))
+        loss = before - after if self.color == chess.WHITE else after - before
+        return max(0, loss)
+
+    @property
+    def label(self) -> str | None:
+        if self.loss >= BLUNDER:
+            return "??"
+        if self.loss >= MISTAKE:
+            return "?"
+        if self.loss >= INACCURACY:
+            return "?!"
+        return None
+
+    def __str__(self):
+        number = self.ply // 2 + 1
+        dots = "." if self.color == chess.WHITE else "..."
+        return (
+            f"{number}{dots} {self.san}{self.label or ''}"
+            f" ({self.before / 100:+.1f} -> {self.after / 100:+.1f})"
+        )
+
+
+def summarize(judgements: list[Judgement], white: str, black: str, worst: int = 5):
+    """Compact report: counts per player and the biggest evaluation swings."""
+    lines = []
+    for color, nick in [(chess.WHITE, white), (chess.BLACK, black)]:
+        own = [j for j in judgements if j.color == color]
+        if not own:
+            continue
+        counts = {label: 0 for label in ("??", "?", "?!")}
+        for j in own:
+            if j.label:
+                counts[j.label] += 1
+        average = sum(j.loss for j in own) / len(own)
+        lines.append(
+            f"{nick}: {counts['??']} blunders, {counts['?']} mistakes,"
+            f" {counts['?!']} inaccuracies, {average:.0f} cp average loss"
+        )
+    swings = sorted(
+        (j for j in judgements if j.label), key=lambda j: j.loss, reverse=True
+    )
+    if swings:
+        lines.append("Biggest swings: " + ", ".join(map(str, swings[:worst])))
+    return lines
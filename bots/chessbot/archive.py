@@ -0,0 +1,182 @@
+import json
+import os
+import zlib
+from functools import lru_cache
+
+from ircbot.utils import debug, log
+
+
+class ArchivedGame:
+    __slots__ = (
+        "id",
+        "white",
+        "black",
+        "channel",
+        "result",
+        "date",
+        "block",
+        "pos",
+        "length",
+    )
+
+    def __init__(
+        self, id, white, black, channel, result, date, pos, length, block=None
+    ):
+        self.id = id
+        self.white = white
+        self.black = black
+        self.channel = channel
+        self.result = result
+        self.date = date
+        self.block = block  # None while the game is still in the tail
+        self.pos = pos
+        self.length = length
+
+
+class GameArchive:
+    def __init__(self, path: str, block_games: int = 64):
+        """Finished games as PGN. New games are appended to a plain tail file
+        and every block_games games the tail is compressed into one zlib block
+        at the end of the archive. An index of json lines keeps where each
+        game lives so a game is read by decompressing only its block.
+
+        :param path: Archive file path. The index and tail live next to it.
+        :param block_games: Number of games compressed together.
+        """
+        self.path = path
+        self.index_path = path + ".idx"
+        self.tail_path = path + ".tail"
+        self.block_games = block_games
+        self.games: list[ArchivedGame] = []
+        self.blocks: list[tuple[int, int]] = []  # (offset, length) in the archive
+        self.by_player: dict[str, list[int]] = {}
+        self.by_channel: dict[str, list[int]] = {}
+        self._unsealed: list[ArchivedGame] = []
+        self._read_block = lru_cache(maxsize=8)(self._decompress)
+
+    def load(self):
+        self.games, self.blocks, self._unsealed = [], [], []
+        self.by_player, self.by_channel = {}, {}
+        try:
+            with open(self.index_path) as index:
+                for n, line in enumerate(index):
+                    try:
+                        self._apply(json.loads(line))
+                    except (json.decoder.JSONDecodeError, KeyError, TypeError):
+                        log(f"Skipping corrupt archive index entry at line {n + 1}")
+        except FileNotFoundError:
+            debug("No game archive found. Starting a new one")
+
+        # Drop index entries whose game never made it to the tail
+        tail_size = (
+            os.path.getsize(self.tail_path) if os.path.exists(self.tail_path) else 0
+        )
+        while (
+            self._unsealed
+            and self._unsealed[-1].pos + self._unsealed[-1].length > tail_size
+        ):
+            game = self._unsealed.pop()
+            log(f"Dropping archived game {game.id}. Reason: missing from the tail")
+            self._unindex(game)
+        if not self._unsealed and tail_size:
+            os.truncate(self.tail_path, 0)
+        log(f"Loaded {len(self.games)} archived games in {len(self.blocks)} blocks")
+
+    def _apply(self, entry: dict):
+        if "block" in entry:
+            offset, length = entry["block"]
+            block = len(self.blocks)
+            self.blocks.append((offset, length))
+            for game in self._unsealed:
+                game.block = block
+            self._unsealed = []
+            return
+        game = ArchivedGame(len(self.games), **entry["game"])
+        self.games.append(game)
+        self.by_player.setdefault(game.white, []).append(game.id)
+        self.by_player.setdefault(game.black, []).append(game.id)
+        self.by_channel.setdefault(game.channel, []).append(game.id)
+        self._unsealed.append(game)
+
+    def _unindex(self, game: ArchivedGame):
+        self.games.pop()
+        for ids in [
+            self.by_player[game.white],
+            self.by_player[game.black],
+            self.by_channel[game.channel],
+        ]:
+            if ids and ids[-1] == game.id:
+                ids.pop()
+
+    def _log(self, entry: dict):
+        with open(self.index_path, "a") as index:
+            index.write(json.dumps(entry) + "\n")
+
+    def add(
+        self, channel: str, white: str, black: str, result: str, date: str, pgn: str
+    ) -> int:
+        """Archives a finished game and returns its id.
+
+        :param pgn: The game exported as PGN text.
+        """
+        data = (pgn.strip() + "\n\n").encode()
+        with open(self.tail_path, "ab") as tail:
+            pos = tail.tell()
+            tail.write(data)
+        entry = {
+            "white": white,
+            "black": black,
+            "channel": channel,
+            "result": result,
+            "date": date,
+            "pos": pos,
+            "length": len(data),
+        }
+        self._log({"game": entry})
+        self._apply({"game": entry})
+        if len(self._unsealed) >= self.block_games:
+            self.seal()
+        return len(self.games) - 1
+
+    def seal(self):
+        """Compresses the tail into a new block."""
+        if not self._unsealed:
+            return
+        with open(self.tail_path, "rb") as tail:
+            block = zlib.compress(tail.read(), 9)
+        with open(self.path, "ab") as archive:
+            offset = archive.seek(0, os.SEEK_END)
+            archive.write(block)
+            archive.flush()
+            os.fsync(archive.fileno())
+        entry = {"block": [offset, len(block)]}
+        self._log(entry)
+        self._apply(entry)
+        os.truncate(self.tail_path, 0)
+        debug(f"Sealed archive block {len(self.blocks) - 1} ({len(block)} bytes)")
+
+    def _decompress(self, offset: int, length: int) -> bytes:
+        with open(self.path, "rb") as archive:
+            archive.seek(offset)
+            return zlib.decompress(archive.read(length))
+
+    def get(self, id: int) -> ArchivedGame | None:
+        return self.games[id] if 0 <= id < len(self.games) else None
+
+    def pgn(self, game: ArchivedGame) -> str:
+        if game.block is None:
+            with open(self.tail_path, "rb") as tail:
+                tail.seek(game.pos)
+                data = tail.read(game.length)
+        else:
+            data = self._read_block(*self.blocks[game.block])
+            data = data[game.pos : game.pos + game.length]
+        return data.decode().strip()
+
+    def recent(self, player: str | None = None, channel: str | None = None, n: int = 5):
+        """Latest games of a player or a channel, newest first."""
+        if player is not None:
+            ids = self.by_player.get(player, [])
+        else:
+            ids = self.by_channel.get(channel, [])
+        return [self.games[id] for id in reversed(ids[-n:])]
@@ -0,0 +1,101 @@
+"""Bytes per ongoing game of the compact game record compared with the Game
+it replaced, for 10k simultaneous correspondence games.
+Run from the chessbot directory: python benchmarks/bench_memory.py
+"""
+
+import json
+import random
+import sys
+import tracemalloc
+from pathlib import Path
+
+import chess
+from ircbot.format import Color
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from game_record import GameRecord  # noqa: E402
+
+GAMES = 10_000
+PREFS = json.dumps(
+    {
+        "fg": [Color.white, Color.black],
+        "bg": [Color.maroon, Color.gray],
+        "label": "   A  B  C  D  E  F  G  H   ",
+        "bmode": "normal",
+    }
+)
+
+
+class LegacyGame:
+    """Game state before the compact record: a board with its move stack,
+    a parallel list of uci strings and decoded prefs for both players."""
+
+    def __init__(self, p1, p2, moves):
+        self.board = chess.Board()
+        self.player = False
+        self.nicks = [p1, p2]
+        self.p1 = p1
+        self.p2 = p2
+        self.history = []
+        for uci in moves:
+            self.board.push_uci(uci)
+            self.player = not self.player
+            self.history.append(uci)
+        # What loadprefs left behind after the first render
+        self.prefs = {p1: json.loads(PREFS), p2: json.loads(PREFS)}
+
+
+def random_games(n: int, seed: int = 0) -> list[list[str]]:
+    rng = random.Random(seed)
+    games = []
+    while len(games) < n:
+        board = chess.Board()
+        for _ in range(rng.randint(10, 80)):
+            if board.is_game_over():
+                break
+            board.push(rng.choice(list(board.legal_moves)))
+        games.append([m.uci() for m in board.move_stack])
+    return games
+
+
+def measure(name: str, build) -> list:
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    games = build()
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    print(f"{name:<28} {used / len(games):>10,.0f} bytes/game {used / 2**20:>8.1f} MiB")
+    return games
+
+
+def main():
+    move_lists = random_games(GAMES)
+    nicks = [(f"player{i}", f"player{i + 1}") for i in range(GAMES)]
+    plies = sum(map(len, move_lists)) / GAMES
+    print(f"{GAMES} games, {plies:.1f} plies on average")
+
+    measure(
+        "legacy Game",
+        lambda: [LegacyGame(a, b, m) for (a, b), m in zip(nicks, move_lists)],
+    )
+
+    def hydrated():
+        games = [GameRecord(a, b, m) for (a, b), m in zip(nicks, move_lists)]
+        for game in games:
+            game.board
+        return games
+
+    measure("record, board materialized", hydrated)
+
+    def released():
+        games = hydrated()
+        for game in games:
+            game.release()
+        return games
+
+    measure("record, board released", released)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""Renders per second of the board renderer compared with the renderer it
+replaced. Run from the chessbot directory: python benchmarks/bench_render.py
+"""
+
+import random
+import sys
+import time
+from copy import deepcopy
+from pathlib import Path
+
+import chess
+from ircbot.format import Color
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import render  # noqa: E402
+
+DEFAULT_PREF = {
+    "fg": [Color.white, Color.black],
+    "bg": [Color.maroon, Color.gray],
+    "label": "   A  B  C  D  E  F  G  H   ",
+    "bmode": "normal",
+}
+PROFILES = [
+    DEFAULT_PREF,
+    dict(DEFAULT_PREF, bg=[Color.purple, Color.red], fg=[Color.white, Color.yellow]),
+    dict(DEFAULT_PREF, bmode="wide", **render.BMODES["wide"]["prefs"]),
+    dict(DEFAULT_PREF, bmode="erc", **render.BMODES["erc"]["prefs"]),
+]
+
+
+def legacy_render(board: chess.Board, prefs: dict) -> list[str]:
+    """Game.utf8_board before the precompiled renderer, minus loadprefs."""
+    R = []
+    bgi = 1
+    row = 8
+    label = prefs["label"]
+    BG = prefs["bg"]
+    FG = prefs["fg"]
+    bmode = prefs["bmode"]
+    layout = (
+        render.BMODES["normal"] if bmode not in render.BMODES else render.BMODES[bmode]
+    )
+    b_map = deepcopy(render.REMAP)
+    b_map.update(layout.get("remap"))
+    R.append(label)
+    for line in str(board).split("\n"):
+        colors = []
+        for c in line:
+            if c.upper() not in b_map:
+                continue
+            piece_type = "pawns" if b_map[c.upper()] == b_map["P"] else "pieces"
+            spacing = layout[piece_type]
+            if c.upper() == c:
+                piece = Color(
+                    f"{' '*spacing[0]}{b_map[c.upper()]}{' '*spacing[1]}",
+                    bg=BG[bgi],
+                    fg=FG[0] if c != "." else BG[bgi],
+                )
+            else:
+                piece = Color(
+                    f"{' '*spacing[0]}{b_map[c.upper()]}{' '*spacing[1]}",
+                    bg=BG[bgi],
+                    fg=FG[1] if c != "." else BG[bgi],
+                )
+            colors.append(piece)
+            bgi = not bgi
+        bgi = not bgi
+        colors[-1].str = colors[-1].str[:-1]
+        sep = " \003 "
+        R.append(str(row) + " " + "".join([c.str for c in colors]) + sep + str(row))
+        row -= 1
+    R.append(label)
+    return R
+
+
+def random_positions(n: int, seed: int = 0) -> list[chess.Board]:
+    rng = random.Random(seed)
+    boards = []
+    board = chess.Board()
+    while len(boards) < n:
+        if board.is_game_over():
+            board = chess.Board()
+        board.push(rng.choice(list(board.legal_moves)))
+        boards.append(board.copy(stack=False))
+    return boards
+
+
+def bench(name: str, fn, jobs: list, seconds: float = 2.0):
+    count = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        for job in jobs:
+            fn(*job)
+        count += len(jobs)
+    elapsed = time.perf_counter() - start
+    print(f"{name:<28} {count / elapsed:>12,.0f} renders/s")
+
+
+def main():
+    boards = random_positions(2000)
+    jobs = [(b, PROFILES[i % len(PROFILES)]) for i, b in enumerate(boards)]
+    fen_jobs = [(b.board_fen(), p) for b, p in jobs]
+
+    for (board, prefs), (board_fen, _) in zip(jobs, fen_jobs):
+        assert legacy_render(board, prefs) == render.render_board(board_fen, prefs)
+
+    bench("legacy utf8_board", legacy_render, jobs)
+    bench(
+        "precompiled, cold cache",
+        render._render.__wrapped__,
+        [(fen, render.profile_key(p)) for fen, p in fen_jobs],
+    )
+    render._render.cache_clear()
+    bench("precompiled, warm cache", render.render_board, fen_jobs[:500])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,371 @@
+"""Game traffic through the real bot. Starts chessbot in a subprocess against
+a fake local IRC server and plays N channels x M concurrent games with random
+legal moves, some of them against the CPU, then reports command latency,
+moves per second, event loop stalls of the bot, its disk writes and its IRC
+output.
+Run from the chessbot directory: python benchmarks/bench_traffic.py --help
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict, deque
+from pathlib import Path
+
+import chess
+
+CHESSBOT_DIR = Path(__file__).resolve().parent.parent
+BOT_NICK = "benchbot"
+REPLY_TIMEOUT = 30  # seconds
+END_MARKERS = ("DRAW!", "STALEMATE!", "CHECKMATE!", "END...")
+
+
+class FakeIrcServer:
+    def __init__(self, members: dict[str, list[str]]):
+        """Just enough IRC for one bot connection. Lines the bot sends to a
+        channel are queued in inbox[channel].
+
+        :param members: Nicks listed by NAMES for each channel.
+        """
+        self.members = members
+        self.inbox: dict[str, asyncio.Queue] = defaultdict(asyncio.Queue)
+        self.connected = asyncio.Event()
+        self.joined: set[str] = set()
+        self.received_lines = 0
+        self.received_bytes = 0
+        self._writer = None
+        self._markers: deque[asyncio.Future] = deque()
+
+    async def start(self) -> int:
+        server = await asyncio.start_server(self._client, "127.0.0.1", 0)
+        return server.sockets[0].getsockname()[1]
+
+    def send(self, line: str):
+        self._writer.write((line + "\r\n").encode())
+
+    def say(self, nick: str, channel: str, text: str):
+        self.send(f":{nick}!{nick}@bench PRIVMSG {channel} :{text}")
+
+    async def flush(self):
+        """Waits until the bot sent everything it queued before now. The bot
+        answers PING through the same queue as its messages."""
+        marker = asyncio.get_running_loop().create_future()
+        self._markers.append(marker)
+        self.send(f"PING {BOT_NICK}")
+        await asyncio.wait_for(marker, REPLY_TIMEOUT)
+
+    async def _client(self, reader, writer):
+        self._writer = writer
+        try:
+            while line := await reader.readline():
+                self.received_lines += 1
+                self.received_bytes += len(line)
+                self._handle(line.decode(errors="replace").rstrip("\r\n"))
+        except (asyncio.CancelledError, ConnectionError):
+            pass
+
+    def _handle(self, line: str):
+        command, _, rest = line.partition(" ")
+        if command == "NICK":
+            self.send(f":fake 001 {BOT_NICK} :Welcome")
+            self.connected.set()
+        elif command == "JOIN":
+            channel = rest.strip()
+            names = " ".join([BOT_NICK] + self.members.get(channel, []))
+            self.send(f":{BOT_NICK}!{BOT_NICK}@bench JOIN {channel}")
+            self.send(f":fake 353 {BOT_NICK} = {channel} :{names}")
+            self.send(f":fake 366 {BOT_NICK} {channel} :End of /NAMES list.")
+            self.joined.add(channel)
+        elif command == "PRIVMSG":
+            target, _, text = rest.partition(" :")
+            self.inbox[target].put_nowait(text.rstrip())
+        elif command == "PONG" and self._markers:
+            self._markers.popleft().set_result(None)
+
+
+class Stats:
+    def __init__(self):
+        self.latencies: dict[str, list[float]] = defaultdict(list)
+        self.moves = 0
+        self.games = 0
+        self.errors = 0
+
+
+class SimGame:
+    def __init__(self, white: str, black: str):
+        self.white = white
+        self.black = black
+        self.board = chess.Board()
+
+    @property
+    def cpu(self) -> bool:
+        return self.black == BOT_NICK
+
+
+async def command(server, stats, kind, nick, channel, text) -> list[str]:
+    """Sends a command and returns every line of the reply."""
+    inbox = server.inbox[channel]
+    began = time.perf_counter()
+    server.say(nick, channel, text)
+    first = await asyncio.wait_for(inbox.get(), REPLY_TIMEOUT)
+    stats.latencies[kind].append(time.perf_counter() - began)
+    await server.flush()
+    lines = [first]
+    while not inbox.empty():
+        lines.append(inbox.get_nowait())
+    return lines
+
+
+async def new_game(server, stats, channel, game: SimGame):
+    game.board = chess.Board()
+    stats.games += 1
+    await command(server, stats, "start", game.white, channel, f";start {game.black}")
+    if not game.cpu:
+        await command(
+            server, stats, "accept", game.black, channel, f";accept {game.white}"
+        )
+
+
+async def play_move(server, stats, channel, game: SimGame):
+    board = game.board
+    mover = game.white if board.turn == chess.WHITE else game.black
+    move = random.choice(list(board.legal_moves))
+    kind = "move vs cpu" if game.cpu else "move"
+    lines = await command(server, stats, kind, mover, channel, f";move {move.uci()}")
+    if lines[0].startswith(END_MARKERS):
+        await new_game(server, stats, channel, game)
+        return
+    if "turn" not in lines[0] and lines[0] != "CHECK":
+        stats.errors += 1
+        await command(server, stats, "end", mover, channel, ";end")
+        await new_game(server, stats, channel, game)
+        return
+    board.push(move)
+    stats.moves += 1
+    if game.cpu:
+        # The reply was the CPU's move, read it back from the history
+        lines = await command(server, stats, "history", mover, channel, ";history")
+        board.push_uci(lines[-1].split()[-1])
+        stats.moves += 1
+
+
+async def undo(server, stats, channel, game: SimGame):
+    board = game.board
+    to_move = game.white if board.turn == chess.WHITE else game.black
+    if game.cpu:
+        await command(server, stats, "undo", to_move, channel, ";undo")
+        board.pop()
+        board.pop()
+        return
+    moved = game.black if to_move == game.white else game.white
+    await command(server, stats, "undo", moved, channel, ";undo")
+    await command(server, stats, "undo", to_move, channel, ";undo")
+    board.pop()
+
+
+async def drive_channel(server, stats, channel, games, deadline):
+    """Plays the games of one channel, one command in flight at a time so
+    every reply line can be told apart."""
+    for game in games:
+        await new_game(server, stats, channel, game)
+    while time.perf_counter() < deadline:
+        game = random.choice(games)
+        nick = game.white if game.board.turn == chess.WHITE else game.black
+        roll = random.random()
+        if roll < 0.1:
+            await command(server, stats, "board", nick, channel, ";board")
+        elif roll < 0.15:
+            square = chess.square_name(
+                random.choice(
+                    list(game.board.pieces(chess.PAWN, game.board.turn)) or [chess.E2]
+                )
+            )
+            await command(server, stats, "hint", nick, channel, f";hint {square}")
+        elif roll < 0.18 and len(game.board.move_stack) >= 2:
+            await undo(server, stats, channel, game)
+        else:
+            await play_move(server, stats, channel, game)
+
+
+def percentile(values: list[float], p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def read_io(pid: int) -> dict[str, int]:
+    try:
+        with open(f"/proc/{pid}/io") as io:
+            return {k: int(v) for k, v in (line.split(": ") for line in io)}
+    except OSError:
+        return {}
+
+
+async def run(args):
+    channels = [f"#bench{c}" for c in range(args.channels)]
+    games = {}
+    for c, channel in enumerate(channels):
+        games[channel] = []
+        for g in range(args.games):
+            white = f"w{c}_{g}"
+            cpu = g < round(args.games * args.cpu_ratio)
+            games[channel].append(SimGame(white, BOT_NICK if cpu else f"b{c}_{g}"))
+    members = {
+        ch: [n for g in games[ch] for n in (g.white, g.black) if n != BOT_NICK]
+        for ch in channels
+    }
+
+    server = FakeIrcServer(members)
+    port = await server.start()
+    data_dir = tempfile.mkdtemp(prefix="chessbot-bench-")
+    stall_file = os.path.join(data_dir, "stalls.json")
+    env = dict(
+        os.environ,
+        IRC_HOST="127.0.0.1",
+        IRC_PORT=str(port),
+        IRC_SSL="false",
+        NICK=BOT_NICK,
+        PASSWORD="",
+        CHANNELS=json.dumps(channels),
+        DB_PATH=data_dir,
+    )
+    bot = subprocess.Popen(
+        [sys.executable, __file__, "--bot", stall_file]
+        + (["--verbose"] if args.verbose else []),
+        cwd=CHESSBOT_DIR,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=None if args.verbose else subprocess.DEVNULL,
+    )
+    try:
+        await asyncio.wait_for(server.connected.wait(), 30)
+        while len(server.joined) < len(channels):
+            await asyncio.sleep(0.1)
+        # Let the bot finish on_connect and drop its greetings
+        await asyncio.sleep(3)
+        await server.flush()
+        for channel in channels:
+            while not server.inbox[channel].empty():
+                server.inbox[channel].get_nowait()
+
+        stats = Stats()
+        io_before = read_io(bot.pid)
+        irc_before = server.received_lines, server.received_bytes
+        began = time.perf_counter()
+        deadline = began + args.duration
+        await asyncio.gather(
+            *[
+                drive_channel(server, stats, channel, games[channel], deadline)
+                for channel in channels
+            ]
+        )
+        elapsed = time.perf_counter() - began
+        io_after = read_io(bot.pid)
+        irc_lines = server.received_lines - irc_before[0]
+        irc_bytes = server.received_bytes - irc_before[1]
+    finally:
+        bot.send_signal(signal.SIGTERM)
+        bot.wait(10)
+
+    print(
+        f"{args.channels} channels x {args.games} games "
+        f"({args.cpu_ratio:.0%} against the cpu) for {elapsed:.1f}s"
+    )
+    print(f"{'command':<14} {'count':>8} {'p50 ms':>9} {'p99 ms':>9}")
+    everything = []
+    for kind, values in sorted(stats.latencies.items()):
+        everything += values
+        print(
+            f"{kind:<14} {len(values):>8} {percentile(values, 0.5) * 1000:>9.1f}"
+            f" {percentile(values, 0.99) * 1000:>9.1f}"
+        )
+    print(
+        f"{'all':<14} {len(everything):>8} {percentile(everything, 0.5) * 1000:>9.1f}"
+        f" {percentile(everything, 0.99) * 1000:>9.1f}"
+    )
+    print(f"moves/s        {stats.moves / elapsed:>10.1f}")
+    print(f"games started  {stats.games:>10}")
+    print(f"desyncs        {stats.errors:>10}")
+    try:
+        with open(stall_file) as f:
+            stalls = json.load(f)
+        print(
+            f"loop stalls    {stalls['total'] * 1000:>10.0f} ms total, "
+            f"{stalls['max'] * 1000:.0f} ms max, {stalls['over_50ms']} over 50 ms"
+        )
+    except (OSError, json.decoder.JSONDecodeError):
+        print("loop stalls    unavailable")
+    if io_before and io_after:
+        # Only bytes headed for storage. syscw and wchar would also count
+        # every line the bot sends to the IRC server
+        written = io_after["write_bytes"] - io_before["write_bytes"]
+        print(f"disk written   {written:>10} ({written / elapsed / 1024:.1f} KiB/s)")
+    print(
+        f"irc output     {irc_lines:>10} lines ({irc_lines / elapsed:.1f}/s), "
+        f"{irc_bytes / elapsed / 1024:.1f} KiB/s"
+    )
+
+
+def run_bot(stall_file: str, verbose: bool):
+    """Runs chessbot in this process, measuring how late the event loop
+    wakes up a 10 ms timer. Stalls are written out on SIGTERM."""
+    sys.path.insert(0, str(CHESSBOT_DIR))
+    import main
+
+    # Debug logging would dominate the measured writes
+    if not verbose:
+        logging.getLogger().setLevel(logging.WARNING)
+
+    stalls = {"total": 0.0, "max": 0.0, "over_50ms": 0}
+
+    def dump():
+        with open(stall_file, "w") as f:
+            json.dump(stalls, f)
+        os._exit(0)
+
+    async def monitor():
+        loop = asyncio.get_running_loop()
+        loop.add_signal_handler(signal.SIGTERM, dump)
+        interval = 0.01
+        while True:
+            start = loop.time()
+            await asyncio.sleep(interval)
+            lag = loop.time() - start - interval
+            if lag > 0.001:
+                stalls["total"] += lag
+                stalls["max"] = max(stalls["max"], lag)
+                stalls["over_50ms"] += lag > 0.05
+
+    async def on_connect():
+        asyncio.create_task(monitor())
+        await main.on_connect()
+
+    main.bot.run_with_callback(on_connect)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--channels", type=int, default=4)
+    parser.add_argument("--games", type=int, default=8, help="games per channel")
+    parser.add_argument("--cpu-ratio", type=float, default=0.5)
+    parser.add_argument("--duration", type=float, default=30, help="seconds")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--verbose", action="store_true", help="show the bot's logs")
+    parser.add_argument("--bot", metavar="STALL_FILE", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.bot:
+        run_bot(args.bot, args.verbose)
+        return
+    random.seed(args.seed)
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
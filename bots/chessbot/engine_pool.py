@@ -0,0 +1,337 @@
+import asyncio
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Hashable
+
+import chess
+import chess.engine
+from ircbot.utils import debug, log
+
+
+@dataclass
+class EngineRequest:
+    board: chess.Board
+    limit: chess.engine.Limit
+    future: asyncio.Future
+
+
+@dataclass(eq=False)
+class PonderJob:
+    board: chess.Board
+    limit: chess.engine.Limit
+    future: asyncio.Future  # (BestMove or None, seconds searched)
+    stop: asyncio.Event = field(default_factory=asyncio.Event)
+    started: bool = False
+
+
+class EnginePool:
+    def __init__(
+        self,
+        path: str,
+        workers: int = 1,
+        timeout: float = 10.0,
+        options: dict | None = None,
+        health_interval: float = 60.0,
+        max_backoff: float = 60.0,
+        max_wait: float = 30.0,
+    ):
+        """Stockfish processes serving queued requests. Each worker
+        supervises its own process: after a failed request or idle
+        health_interval seconds it pings the engine with isready and
+        restarts it, retrying with exponential backoff, if it doesn't answer.
+
+        :param path: Path to the stockfish binary.
+        :param workers: Number of stockfish processes to keep running.
+        :param timeout: Seconds added to each request time limit before giving up on the engine.
+        :param options: UCI options such as Threads, Hash or Skill Level.
+        :param health_interval: Seconds a worker may stay idle before checking its engine.
+        :param max_backoff: Longest wait between attempts to start an engine.
+        :param max_wait: Longest play waits for a move, time in the queue
+            included, so callers get an answer even if no engine is running.
+        """
+        self.path = path
+        self.workers = max(1, workers)
+        self.timeout = timeout
+        self.options = options or {}
+        self.health_interval = health_interval
+        self.max_backoff = max_backoff
+        self.max_wait = max_wait
+        self.requests = 0
+        self.failures = 0
+        self.restarts = 0
+        self.latencies: deque[float] = deque(maxlen=1000)
+        self._queues: dict[str, deque[EngineRequest]] = {}
+        self._channels: deque[str] = deque()
+        self._cond = asyncio.Condition()
+        self._start_lock = asyncio.Lock()
+        self._engines: dict[
+            int, tuple[asyncio.SubprocessTransport, chess.engine.UciProtocol]
+        ] = {}
+        self._tasks: list[asyncio.Task] = []
+        self._idle = 0
+        self._ponders: dict[Hashable, PonderJob] = {}
+        self._pending_ponders: deque[PonderJob] = deque()
+        self._running_ponders: set[PonderJob] = set()
+        self._closing = False
+
+    @property
+    def pending(self) -> int:
+        return sum(len(queue) for queue in self._queues.values())
+
+    def stats(self) -> dict:
+        """Request counters and engine latency over the last requests, in ms."""
+        latencies = sorted(self.latencies)
+        stats = {
+            "workers": len(self._engines),
+            "requests": self.requests,
+            "failures": self.failures,
+            "restarts": self.restarts,
+            "queued": self.pending,
+        }
+        if latencies:
+            stats["p50"] = round(latencies[len(latencies) // 2] * 1000)
+            stats["p99"] = round(latencies[int(len(latencies) * 0.99)] * 1000)
+            stats["max"] = round(latencies[-1] * 1000)
+        return stats
+
+    async def start(self):
+        async with self._start_lock:
+            if self._tasks:
+                return
+            log(f"Starting {self.workers} stockfish workers")
+            # Start the first engine here so a wrong path fails loudly
+            await self._open(0, retry=False)
+            self._tasks = [
+                asyncio.create_task(self._worker(slot)) for slot in range(self.workers)
+            ]
+
+    async def close(self):
+        self._closing = True
+        # python-chess can swallow the cancellation of a running analysis,
+        # so ponders are stopped too and workers check the flag after them
+        for job in self._running_ponders:
+            job.stop.set()
+        for task in self._tasks:
+            task.cancel()
+        # A worker still running would find its engine gone and fail
+        if self._tasks:
+            await asyncio.wait(self._tasks, timeout=self.timeout)
+        for slot in list(self._engines):
+            await self._kill(slot)
+        self._tasks = []
+
+    async def _open(self, slot: int, retry: bool = True) -> chess.engine.UciProtocol:
+        if slot in self._engines:
+            return self._engines[slot][1]
+        backoff = 1.0
+        while True:
+            try:
+                transport, engine = await chess.engine.popen_uci(self.path)
+                await engine.configure(
+                    {k: v for k, v in self.options.items() if k in engine.options}
+                )
+                self._engines[slot] = (transport, engine)
+                return engine
+            except (OSError, chess.engine.EngineError) as e:
+                if not retry:
+                    raise
+                log(f"Stockfish worker {slot} failed to start: {e!r}")
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, self.max_backoff)
+
+    async def _kill(self, slot: int, graceful: bool = True):
+        transport, engine = self._engines.pop(slot)
+        if graceful:
+            try:
+                await asyncio.wait_for(engine.quit(), 1)
+            except Exception:
+                pass
+        transport.close()
+
+    async def _healthy(self, engine: chess.engine.UciProtocol) -> bool:
+        try:
+            await asyncio.wait_for(engine.ping(), self.timeout)
+            return True
+        except Exception as e:
+            debug(f"Engine health check failed: {e!r}")
+            return False
+
+    async def _check(self, slot: int) -> chess.engine.UciProtocol:
+        """Returns the worker's engine, restarting it if it doesn't respond."""
+        engine = self._engines[slot][1]
+        if await self._healthy(engine):
+            return engine
+        self.restarts += 1
+        log(f"Restarting stockfish worker {slot}")
+        await self._kill(slot, graceful=False)
+        return await self._open(slot)
+
+    async def play(
+        self, board: chess.Board, channel: str, limit: chess.engine.Limit
+    ) -> chess.engine.PlayResult:
+        """Queues the position and waits for the engine's move. The board is
+        copied so the caller is free to change it while waiting.
+
+        :param board: Position to play from.
+        :param channel: Queue the request belongs to.
+        :param limit: Search limit for this request.
+        """
+        await self.start()
+        future = asyncio.get_running_loop().create_future()
+        async with self._cond:
+            if channel not in self._queues:
+                self._queues[channel] = deque()
+                self._channels.append(channel)
+            self._queues[channel].append(EngineRequest(board.copy(), limit, future))
+            # Real requests always win over pondering
+            busy = self.pending - self._idle
+            for job in list(self._running_ponders)[: max(0, busy)]:
+                job.stop.set()
+            self._cond.notify()
+        # Cancels the future on timeout, so workers skip the request
+        return await asyncio.wait_for(future, self.max_wait)
+
+    async def ponder(
+        self, key: Hashable, board: chess.Board, limit: chess.engine.Limit
+    ):
+        """Analyses a position the opponent is expected to reach while a
+        worker would otherwise be idle. Replaces any ponder under key.
+
+        :param key: Identifies the game being pondered.
+        :param board: Expected position after the opponent's move.
+        :param limit: Longest the worker may spend on it.
+        """
+        await self.start()
+        self.cancel_ponder(key)
+        future = asyncio.get_running_loop().create_future()
+        job = PonderJob(board.copy(), limit, future)
+        self._ponders[key] = job
+        async with self._cond:
+            self._pending_ponders.append(job)
+            self._cond.notify()
+
+    def cancel_ponder(self, key: Hashable):
+        job = self._ponders.pop(key, None)
+        if job is not None:
+            job.stop.set()
+
+    async def take_ponder(
+        self, key: Hashable, board: chess.Board, min_time: float = 0
+    ) -> chess.engine.BestMove | None:
+        """Stops pondering for key and returns its best move, along with the
+        reply it expects, if the position is the one that was pondered.
+
+        :param key: Identifies the game being pondered.
+        :param board: Position actually reached.
+        :param min_time: Discard moves searched for less than this.
+        """
+        job = self._ponders.pop(key, None)
+        if job is None:
+            return None
+        job.stop.set()
+        if not job.started or job.board != board:
+            debug("Ponder miss")
+            return None
+        try:
+            best, searched = await asyncio.wait_for(job.future, self.timeout)
+        except asyncio.TimeoutError:
+            return None
+        if (
+            best is None
+            or best.move is None
+            or searched < min_time
+            or not board.is_legal(best.move)
+        ):
+            return None
+        debug(f"Ponder hit after {searched:.2f} seconds")
+        return best
+
+    async def _next_request(self) -> EngineRequest | PonderJob | None:
+        """Next job, or None after health_interval seconds without one."""
+        async with self._cond:
+            self._idle += 1
+            try:
+                await asyncio.wait_for(
+                    self._cond.wait_for(
+                        lambda: self._channels or self._pending_ponders
+                    ),
+                    self.health_interval,
+                )
+            except asyncio.TimeoutError:
+                return None
+            finally:
+                self._idle -= 1
+            if not self._channels:
+                return self._pending_ponders.popleft()
+            channel = self._channels.popleft()
+            queue = self._queues[channel]
+            request = queue.popleft()
+            if queue:
+                self._channels.append(channel)
+            else:
+                del self._queues[channel]
+            return request
+
+    async def _worker(self, slot: int):
+        engine = await self._open(slot)
+        loop = asyncio.get_running_loop()
+        while True:
+            request = await self._next_request()
+            if request is None:
+                engine = await self._check(slot)
+                continue
+            if isinstance(request, PonderJob):
+                ok = await self._ponder(engine, request)
+                if self._closing:
+                    return
+                if not ok:
+                    engine = await self._check(slot)
+                continue
+            if request.future.done():
+                continue
+            timeout = (request.limit.time or 0) + self.timeout
+            self.requests += 1
+            began = loop.time()
+            try:
+                result = await asyncio.wait_for(
+                    engine.play(request.board, request.limit), timeout
+                )
+            except Exception as e:
+                debug(f"Engine request failed: {e!r}")
+                self.failures += 1
+                if not request.future.done():
+                    request.future.set_exception(e)
+                engine = await self._check(slot)
+                continue
+            self.latencies.append(loop.time() - began)
+            if not request.future.done():
+                request.future.set_result(result)
+
+    async def _ponder(self, engine: chess.engine.UciProtocol, job: PonderJob) -> bool:
+        """Runs a ponder job. False if the engine failed while pondering."""
+        if job.stop.is_set():
+            return True
+        job.started = True
+        self._running_ponders.add(job)
+        loop = asyncio.get_running_loop()
+        began = loop.time()
+        best = None
+        ok = True
+        try:
+            with await engine.analysis(job.board, job.limit) as analysis:
+                finished = asyncio.ensure_future(analysis.wait())
+                stopped = asyncio.ensure_future(job.stop.wait())
+                await asyncio.wait(
+                    (finished, stopped), return_when=asyncio.FIRST_COMPLETED
+                )
+                stopped.cancel()
+                analysis.stop()
+                best = await asyncio.wait_for(finished, self.timeout)
+        except Exception as e:
+            debug(f"Ponder failed: {e!r}")
+            ok = False
+        finally:
+            self._running_ponders.discard(job)
+        if not job.future.done():
+            job.future.set_result((best, loop.time() - began))
+        return ok
@@ -0,0 +1,101 @@
+from array import array
+
+import chess
+from ircbot.utils import debug, log
+from move_table import MoveTable
+
+
+def pack_move(move: chess.Move) -> int:
+    """Fits a move in 15 bits: from square, to square and promotion piece."""
+    return move.from_square | move.to_square << 6 | (move.promotion or 0) << 12
+
+
+def unpack_move(code: int) -> chess.Move:
+    return chess.Move(code & 63, code >> 6 & 63, code >> 12 or None)
+
+
+class GameRecord:
+    __slots__ = ("p1", "p2", "moves", "_fen", "_board", "_table")
+
+    def __init__(self, p1, p2, moves=None, fen=None):
+        """Compact game between two players. Moves are kept as packed 16 bit
+        integers and the chess.Board is only built when a move, undo or legal
+        move lookup needs it, and can be released again with release.
+
+        :param p1: White player.
+        :param p2: Black player.
+        :param moves: UCI moves of a restored game.
+        :param fen: Snapshot of the position after moves.
+        """
+        self.p1 = p1
+        self.p2 = p2
+        self.moves = array("H")
+        for n, uci in enumerate(moves or ()):
+            try:
+                self.moves.append(pack_move(chess.Move.from_uci(uci)))
+            except ValueError:
+                log(f"Dropping stored moves from invalid move {n}: {uci}")
+                fen = None
+                break
+        self._fen = fen
+        self._board = None if self.moves else chess.Board()
+        self._table = None
+
+    @property
+    def nicks(self) -> tuple[str, str]:
+        return (self.p1, self.p2)
+
+    @property
+    def player(self) -> bool:
+        """False when it is white's (p1) turn."""
+        return len(self.moves) % 2 == 1
+
+    @property
+    def history(self) -> list[str]:
+        return [unpack_move(code).uci() for code in self.moves]
+
+    @property
+    def board(self) -> chess.Board:
+        if self._board is None:
+            debug(f"Hydrating game {self.p1} vs {self.p2}")
+            board = chess.Board()
+            for n, code in enumerate(self.moves):
+                move = unpack_move(code)
+                if not board.is_legal(move):
+                    log(f"Dropping stored moves from invalid move {n}: {move}")
+                    del self.moves[n:]
+                    break
+                board.push(move)
+            self._board = board
+        return self._board
+
+    @property
+    def table(self) -> MoveTable:
+        """Legal moves and outcome of the current position, built once until
+        the next move or undo."""
+        if self._table is None:
+            self._table = MoveTable(self.board)
+        return self._table
+
+    def fen(self) -> str:
+        if self._board is None and self._fen:
+            return self._fen
+        return self.board.fen()
+
+    def release(self):
+        """Drops the board, keeping a FEN snapshot for rendering."""
+        if self._board is not None:
+            self._fen = self._board.fen()
+            self._board = None
+            self._table = None
+
+    def move(self, uic: str):
+        move = self.board.parse_uci(uic)
+        self.board.push(move)
+        self._table = None
+        self.moves.append(pack_move(move))
+
+    def pop(self):
+        self.board.pop()
+        self._table = None
+        self.moves.pop()
@@ -0,0 +1,147 @@
+import json
+import os
+
+from ircbot.utils import debug, log
+
+GameKey = tuple[str, str, str]  # (channel, p1, p2)
+
+
+class StoredGame:
+    __slots__ = ("moves", "fen")
+
+    def __init__(self, moves: list[str] | None = None, fen: str | None = None):
+        self.moves = moves or []
+        self.fen = fen
+
+
+class GameJournal:
+    def __init__(self, path: str, compact_every: int = 1000):
+        """Append only store for ongoing games. Every change is a single json
+        line and the file is rewritten with one line per live game once
+        compact_every lines were appended since the last compaction.
+
+        :param path: Journal file path.
+        :param compact_every: Number of appended entries that triggers a compaction.
+        """
+        self.path = path
+        self.compact_every = compact_every
+        self.games: dict[GameKey, StoredGame] = {}
+        self._appended = 0
+        self._file = None
+
+    def key(self, channel: str, p1: str, p2: str) -> GameKey | None:
+        for key in [(channel, p1, p2), (channel, p2, p1)]:
+            if key in self.games:
+                return key
+        return None
+
+    def load(self) -> dict[GameKey, StoredGame]:
+        debug("Replaying ongoing games journal")
+        self.games = {}
+        try:
+            with open(self.path) as journal:
+                for n, line in enumerate(journal):
+                    try:
+                        self._apply(json.loads(line))
+                    except (json.decoder.JSONDecodeError, KeyError, TypeError):
+                        log(f"Skipping corrupt journal entry at line {n + 1}")
+        except FileNotFoundError:
+            debug("No journal found. Starting a new one")
+        self.compact()
+        return self.games
+
+    def import_json(self, data: dict):
+        """Imports the old {nick: {channel: {against_nick: [moves]}}} store."""
+        for nick in data:
+            for channel in data[nick]:
+                for against_nick, moves in data[nick][channel].items():
+                    if self.key(channel, nick, against_nick) is None:
+                        self.games[(channel, nick, against_nick)] = StoredGame(
+                            list(moves)
+                        )
+        self.compact()
+
+    def add(self, channel: str, p1: str, p2: str):
+        if self.key(channel, p1, p2) is not None:
+            return
+        self._write({"op": "add", "c": channel, "p1": p1, "p2": p2})
+
+    def sync(self, channel: str, p1: str, p2: str, history: list[str], fen: str | None):
+        """Records the difference between the stored moves and history along
+        with a snapshot of the resulting position."""
+        key = self.key(channel, p1, p2)
+        if key is None:
+            return
+        stored = self.games[key].moves
+        keep = min(len(stored), len(history))
+        if history[:keep] != stored[:keep]:
+            keep = next(i for i in range(keep) if history[i] != stored[i])
+        if keep == len(stored) == len(history):
+            return
+        channel, p1, p2 = key
+        self._write(
+            {
+                "op": "set",
+                "c": channel,
+                "p1": p1,
+                "p2": p2,
+                "keep": keep,
+                "push": history[keep:],
+                "fen": fen,
+            }
+        )
+
+    def delete(self, channel: str, p1: str, p2: str):
+        key = self.key(channel, p1, p2)
+        if key is None:
+            return
+        channel, p1, p2 = key
+        self._write({"op": "del", "c": channel, "p1": p1, "p2": p2})
+
+    def compact(self):
+        debug(f"Compacting journal with {len(self.games)} games")
+        self.close()
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as outfile:
+            for (channel, p1, p2), game in self.games.items():
+                entry = {
+                    "op": "set",
+                    "c": channel,
+                    "p1": p1,
+                    "p2": p2,
+                    "keep": 0,
+                    "push": game.moves,
+                    "fen": game.fen,
+                }
+                outfile.write(json.dumps(entry) + "\n")
+            outfile.flush()
+            os.fsync(outfile.fileno())
+        os.replace(tmp_path, self.path)
+        self._appended = 0
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _apply(self, entry: dict):
+        key = (entry["c"], entry["p1"], entry["p2"])
+        if entry["op"] == "add":
+            self.games[key] = StoredGame()
+        elif entry["op"] == "set":
+            game = self.games.get(key) or StoredGame()
+            game.moves = game.moves[: entry["keep"]] + entry["push"]
+            game.fen = entry.get("fen")
+            self.games[key] = game
+        elif entry["op"] == "del":
+            self.games.pop(key, None)
+
+    def _write(self, entry: dict):
+        self._apply(entry)
+        if self._file is None:
+            self._file = open(self.path, "a")
+        self._file.write(json.dumps(entry) + "\n")
+        self._file.flush()
+        self._appended += 1
+        if self._appended >= self.compact_every:
+            self.compact()
@@ -8,22 +8,39 @@
 #                                                                       #
 #########################################################################
 
+import asyncio
+import io
 import json
 import logging
 import os
 import re
 import shutil
-from copy import copy, deepcopy
+import signal
+import textwrap
+from copy import copy
 from datetime import datetime
 
 import chess
 import chess.engine
+import chess.pgn
+from analysis import Analyzer, summarize
+from archive import GameArchive
 from dotenv import load_dotenv
+from engine_pool import EnginePool
+from game_record import GameRecord
+from game_store import GameJournal
 from ircbot import IrcBot, utils
 from ircbot.client import PersistentData
 from ircbot.format import Color
 from ircbot.message import Message
 from ircbot.utils import debug, log
+from members import ChannelMembers
+from move_cache import MoveCache, OpeningBook, Tablebase
+from players import PlayerRepository
+from prefs import PrefCache
+from ratings import GLOBAL, Ratings
+from render import BMODES, render_profile
+from scheduler import DeadlineScheduler
 
 load_dotenv()
 
@@ -59,6 +76,20 @@ if not STOCKFISH:
     )
 
 TIME_TO_THINK = 0.05
+ENGINE_WORKERS = int(os.getenv("ENGINE_WORKERS") or 2)
+ENGINE_TIMEOUT = float(os.getenv("ENGINE_TIMEOUT") or 10)
+ENGINE_OPTIONS = {
+    name: int(value)
+    for name, value in {
+        "Threads": os.getenv("ENGINE_THREADS"),
+        "Hash": os.getenv("ENGINE_HASH"),  # MB
+        "Skill Level": os.getenv("ENGINE_SKILL"),  # 0 to 20
+    }.items()
+    if value
+}
+ANALYSIS_WORKERS = int(os.getenv("ANALYSIS_WORKERS") or 1)
+ANALYSIS_DEPTH = int(os.getenv("ANALYSIS_DEPTH") or 12)
+PONDER_TIME = float(os.getenv("PONDER_TIME") or 5)  # 0 disables pondering
 EXPIRE_INVITE_IN = 60  # secods
 EXPIRE_REQUEST_TIME = 15
 DEFAULT_PREF = {
@@ -70,6 +101,20 @@ DEFAULT_PREF = {
 DB_PATH = os.getenv("DB_PATH") or "."
 os.makedirs(DB_PATH, exist_ok=True)
 ONGOING_GAMES_STORE = os.path.join(DB_PATH, f"{NICK}_ongoing_games.json")
+ONGOING_GAMES_JOURNAL = os.path.join(DB_PATH, f"{NICK}_ongoing_games.journal")
+COMPACT_JOURNAL_EVERY = 1000  # appended entries
+FLUSH_PLAYERS_EVERY = 5  # seconds
+MOVE_CACHE = os.path.join(DB_PATH, f"{NICK}_move_cache.json")
+MOVE_CACHE_SIZE = int(os.getenv("MOVE_CACHE_SIZE") or 100_000)
+SAVE_MOVE_CACHE_EVERY = 60  # seconds
+RELEASE_BOARD_AFTER = 600  # seconds without moves
+ARCHIVE = os.path.join(DB_PATH, f"{NICK}_archive.pgz")
+ARCHIVE_BLOCK_GAMES = 64
+RATINGS = os.path.join(DB_PATH, f"{NICK}_ratings.json")
+SAVE_RATINGS_EVERY = 60  # seconds
+RESULT_SCORES = {"1-0": 1, "1/2-1/2": 0.5, "0-1": 0}
+OPENING_BOOK = os.getenv("OPENING_BOOK")  # polyglot .bin file
+SYZYGY_PATH = os.getenv("SYZYGY_PATH")  # directory with syzygy tables
 
 ############################################################
 
@@ -77,179 +122,173 @@ ONGOING_GAMES_STORE = os.path.join(DB_PATH, f"{NICK}_ongoing_games.json")
 db_columns = ["nick", "checkmates", "stalemates", "draws", "games", "losses", "prefs"]
 db_handler = PersistentData(os.path.join(DB_PATH, NICK + ".db"), "users", db_columns)
 
-# Initialize bot
-bot = IrcBot(HOST, PORT, NICK, CHANNELS, PASSWORD, use_ssl=SSL, tables=[db_handler])
+players = PlayerRepository(
+    db_handler,
+    {
+        "checkmates": 0,
+        "stalemates": 0,
+        "draws": 0,
+        "games": 0,
+        "losses": 0,
+        "prefs": json.dumps(DEFAULT_PREF),
+    },
+)
+
+# Initialize bot. The users table is not registered with it since players are
+# served from memory and written behind by the player repository
+bot = IrcBot(HOST, PORT, NICK, CHANNELS, PASSWORD, use_ssl=SSL)
 utils.set_loglevel(LEVEL)
 bot.set_prefix(PREFIX).set_help_on_private(True).set_simplify_commands(False)
 
 
 def get_data(nick):
-    for user in db_handler.data:
-        if nick == user[db_columns[0]]:
-            return user
+    return players.get(nick)
 
 
 def create_data(nick):
-    default_data = {
-        "nick": nick,
-        "checkmates": 0,
-        "stalemates": 0,
-        "draws": 0,
-        "games": 0,
-        "losses": 0,
-        "prefs": json.dumps(DEFAULT_PREF),
-        "ongoing_games": "{}",  # {channel: against_nick: [b2b4,c3c6..]}
-    }
-    db_handler.push(default_data)
-    return default_data
+    return players.get_or_create(nick)
 
 
-def save_ongoing_games(data):
-    debug("Reading ongoing games json")
-    with open(ONGOING_GAMES_STORE, "w") as outfile:
-        json.dump(data, outfile)
+journal = GameJournal(ONGOING_GAMES_JOURNAL, compact_every=COMPACT_JOURNAL_EVERY)
 
 
 def load_ongoing_games():
-    debug("Trying to read ongoing games json")
-    data = {}
-    try:
-        with open(ONGOING_GAMES_STORE) as json_file:
-            data = json.load(json_file)
-    except FileNotFoundError:
-        debug("Read failed. Creating new file json")
-        save_ongoing_games({})
-        return load_ongoing_games()
-    except json.decoder.JSONDecodeError:
-        log("!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!")
-        log("Recreating json store. Reason: File is corrupt")
-        data = {}
-        with open(ONGOING_GAMES_STORE, "w") as outfile:
-            json.dump(data, outfile)
+    debug("Trying to read ongoing games journal")
+    data = journal.load()
+    if os.path.exists(ONGOING_GAMES_STORE):
+        log("Migrating ongoing games json store to the journal")
+        try:
+            with open(ONGOING_GAMES_STORE) as json_file:
+                journal.import_json(json.load(json_file))
+        except json.decoder.JSONDecodeError:
+            log("Ignoring old json store. Reason: File is corrupt")
+        os.replace(ONGOING_GAMES_STORE, ONGOING_GAMES_STORE + ".bak")
     return data
 
 
 def add_game(nick, against_nick, channel):
-    ongoing_games = load_ongoing_games()
-    if channel in ongoing_games and against_nick in ongoing_games[channel]:
-        return
-    if nick not in ongoing_games:
-        ongoing_games[nick] = {}
-    if channel not in ongoing_games:
-        ongoing_games[nick][channel] = {}
-    ongoing_games[nick][channel][against_nick] = []
-    save_ongoing_games(ongoing_games)
+    journal.add(channel, nick, against_nick)
     debug("Created ongoing game Data!!!!!")
     return True
 
 
-def update_game(nick, against_nick, channel, game, nocheck=False):
-    ongoing_games = load_ongoing_games()
-    debug(f"Searching for {nick=} {channel=} {ongoing_games=} ")
-    if (
-        nick in ongoing_games
-        and channel in ongoing_games[nick]
-        and against_nick in ongoing_games[nick][channel]
-    ):
-        ongoing_games[nick][channel][against_nick] = game.history
-        save_ongoing_games(ongoing_games)
-        debug("Updated ongoing game Data!!!!!")
-        return True
-    if nocheck:
-        return
-    update_game(game.other(nick), nick, channel, game, nocheck=True)
+def update_game(nick, against_nick, channel, game):
+    journal.sync(channel, nick, against_nick, game.history, game.fen())
+    # Waiting games only keep their packed moves and a FEN
+    scheduler.schedule(
+        ("release", channel, frozenset((nick, against_nick))),
+        RELEASE_BOARD_AFTER,
+        game.release,
+    )
+    debug("Updated ongoing game Data!!!!!")
+    return True
 
 
-def delete_game(nick, against_nick, channel, game, nocheck=False):
-    ongoing_games = load_ongoing_games()
-    if (
-        nick in ongoing_games
-        and channel in ongoing_games[nick]
-        and against_nick in ongoing_games[nick][channel]
-    ):
-        del ongoing_games[nick][channel][against_nick]
-        save_ongoing_games(ongoing_games)
-        debug("Removed ongoing game Data!!!!!")
-        return True
-    if nocheck:
-        return
-    delete_game(game.other(nick), nick, channel, game, nocheck=True)
+def delete_game(nick, against_nick, channel, game, result=None):
+    """delete_game.
 
+    :param result: PGN result to archive the game with. Taken from the board if None.
+    """
+    journal.delete(channel, nick, against_nick)
+    debug("Removed ongoing game Data!!!!!")
+    result = result or game.table.result
+    if game.moves:
+        archive_game(channel, game, result)
+    if result in RESULT_SCORES:
+        ratings.record(channel, game.p1, game.p2, RESULT_SCORES[result])
+    return True
 
-def increment_data(nick, column):
-    data = get_data(nick)
-    if data is None:
-        data = {
-            "nick": nick,
-            "checkmates": 0,
-            "stalemates": 0,
-            "draws": 0,
-            "games": 0,
-            "losses": 0,
-            "prefs": json.dumps(DEFAULT_PREF),
-            "ongoing_games": "{}",  # {channel: against_nick: [b2b4,c3c6..]}
-        }
-        data.update({column: 1})
-        log("Creating player data")
-        db_handler.push(data)
-        return data
-    else:
-        log("incrementing player data")
-        data.update({column: data[column] + 1})
-        db_handler.update(data["id"], data)
+
+ratings = Ratings(RATINGS)
+ratings.load()
+
+
+archive = GameArchive(ARCHIVE, block_games=ARCHIVE_BLOCK_GAMES)
+archive.load()
+
+
+def archive_game(channel, game, result):
+    pgn = chess.pgn.Game.from_board(game.board)
+    date = datetime.now().strftime("%Y.%m.%d")
+    pgn.headers.update(
+        Event="IRC game",
+        Site=channel,
+        Date=date,
+        White=game.p1,
+        Black=game.p2,
+        Result=result,
+    )
+    try:
+        id = archive.add(channel, game.p1, game.p2, result, date, str(pgn))
+    except OSError as e:
+        log(f"Failed to archive game {game.p1} vs {game.p2}: {e!r}")
+        return None
+    debug(f"Archived game {id}")
+    return id
+
+
+def increment_data(nick, *columns):
+    debug(f"incrementing {columns} of {nick}")
+    return players.increment(nick, *columns)
 
 
 def update_data(nick, data):
-    for user in db_handler.data:
-        if nick == user[db_columns[0]]:
-            user.update(data)
-            db_handler.update(user["id"], user)
-            return True
+    if get_data(nick) is None:
+        return None
+    players.update(nick, **data)
+    return True
 
 
 ####################################################################################
 # Player logics
 
-remap = {
-    "R": "♜",
-    "N": "♞",
-    "B": "♝",
-    "Q": "♛",
-    "K": "♚",
-    "P": "♟︎",
-    ".": "♟︎",
-}
-
-engine = chess.engine.SimpleEngine.popen_uci(STOCKFISH)
-
+engine_pool = EnginePool(
+    STOCKFISH, workers=ENGINE_WORKERS, timeout=ENGINE_TIMEOUT, options=ENGINE_OPTIONS
+)
+analyzer = Analyzer(
+    STOCKFISH, workers=ANALYSIS_WORKERS, depth=ANALYSIS_DEPTH, options=ENGINE_OPTIONS
+)
+move_cache = MoveCache(MOVE_CACHE, maxsize=MOVE_CACHE_SIZE)
+move_cache.load()
+opening_book = OpeningBook(OPENING_BOOK)
+tablebase = Tablebase(SYZYGY_PATH)
+
+
+async def cpuPlay(board: chess.Board, channel: str, key=None):
+    pondered = await engine_pool.take_ponder(key, board, TIME_TO_THINK)
+    expected_reply = None
+    move = tablebase.move(board)
+    if move is None and pondered is not None:
+        move, expected_reply = pondered.move, pondered.ponder
+    if move is None:
+        move = opening_book.move(board) or move_cache.get(board, TIME_TO_THINK)
+    if move is None:
+        result = await engine_pool.play(
+            board, channel, chess.engine.Limit(time=TIME_TO_THINK)
+        )
+        move = result.move
+        move_cache.put(board, TIME_TO_THINK, move)
+        expected_reply = result.ponder
+    if PONDER_TIME and expected_reply and key is not None:
+        # Think on the human's time about the reply the engine expects
+        expected = board.copy(stack=False)
+        expected.push(move)
+        expected.push(expected_reply)
+        if not tablebase.covers(expected):
+            await engine_pool.ponder(
+                key, expected, chess.engine.Limit(time=PONDER_TIME)
+            )
+    return move.uci()
 
-def cpuPlay(board: chess.Board):
-    global engine
-    result = engine.play(board, chess.engine.Limit(time=TIME_TO_THINK))
-    board.push(result.move)
-    return result.move.uci()
 
+class Game(GameRecord):
+    __slots__ = ()
 
-class Game:
     BG_CLASSIC = [Color.maroon, Color.gray]
     FG_CLASSIC = [Color.white, Color.black]
     BG_MODERN = [Color.purple, Color.red]
     FG_MODERN = [Color.white, Color.yellow]
-    BMODES = {
-        "normal": {"pieces": [1, 1], "pawns": [1, 1], "remap": {}},
-        "wide": {
-            "remap": {".": "♟", "P": "♟"},
-            "pieces": [2, 2],
-            "pawns": [2, 2],
-            "prefs": {"label": "    A     B     C    D     E     F     G     H"},
-        },
-        "erc": {
-            "remap": {".": "♟", "P": "♟"},
-            "pieces": [1, 1],
-            "pawns": [1, 1],
-            "prefs": {"label": "   A  B  C  D  E  F  G  H"},
-        },
-    }
+    BMODES = BMODES
 
     LABEL = [
         "   A  B  C  D  E  F  G  H   ",
@@ -259,89 +298,22 @@ class Game:
 
     PREF = DEFAULT_PREF
 
-    def __init__(self, p1, p2):
-        self.board = chess.Board()
-        self.player = False
-        self.nicks = [p1, p2]
-        self.p1 = p1
-        self.p2 = p2
-        self.prefs = {
-            self.p1: Game.PREF,
-            self.p2: Game.PREF,
-        }
-        self.history = []
-
-    def loadprefs(self):
-        pref1 = get_data(self.p1)
-        pref2 = get_data(self.p2)
-        pref1 = pref1["prefs"] if pref1 else None
-        pref2 = pref2["prefs"] if pref2 else None
-        self.prefs = {
-            self.p1: json.loads(pref1) if pref1 else Game.PREF,
-            self.p2: json.loads(pref2) if pref2 else Game.PREF,
-        }
-
     def who(self):
         return self.nicks[self.player]
 
-    def pop(self):
-        self.board.pop()
-        self.player = not self.player
-        self.history.pop()
-
-    def move(self, uic):
-        self.board.push_uci(uic)
-        self.player = not self.player
-        self.history.append(uic)
-
     def other(self, nick):
         return self.p1 if nick == self.p2 else self.p2
 
     def utf8_board(self, nick):
-        self.loadprefs()
-        R = []
-        bgi = 1
-        row = 8
-        label = self.prefs[nick]["label"]
-        BG = self.prefs[nick]["bg"]
-        FG = self.prefs[nick]["fg"]
-        bmode = self.prefs[nick]["bmode"]
-        layout = (
-            self.BMODES["normal"] if bmode not in self.BMODES else self.BMODES[bmode]
-        )
-        b_map = deepcopy(remap)
-        b_map.update(layout.get("remap"))
-
-        # Create colored UTF8 board from ASCII board
-        R.append(label)
-        for line in str(self.board).split("\n"):
-            colors = []
-            for c in line:
-                if c.upper() not in b_map:
-                    continue
-                piece_type = "pawns" if b_map[c.upper()] == b_map["P"] else "pieces"
-                spacing = layout[piece_type]
-                if c.upper() == c:
-                    piece = Color(
-                        f"{' '*spacing[0]}{b_map[c.upper()]}{' '*spacing[1]}",
-                        bg=BG[bgi],
-                        fg=FG[0] if c != "." else BG[bgi],
-                    )
-                else:
-                    piece = Color(
-                        f"{' '*spacing[0]}{b_map[c.upper()]}{' '*spacing[1]}",
-                        bg=BG[bgi],
-                        fg=FG[1] if c != "." else BG[bgi],
-                    )
-                colors.append(piece)
-                bgi = not bgi
-            bgi = not bgi
-            colors[-1].str = colors[-1].str[:-1]
-            sep = " \003 "
-            R.append(str(row) + " " + "".join([c.str for c in colors]) + sep + str(row))
-            row -= 1
-        R.append(label)
-        return R
+        return render_profile(self.fen().split()[0], pref_cache.profile(nick))
+
+
+def stored_prefs(nick):
+    data = get_data(nick)
+    return data["prefs"] if data else None
+
+
+pref_cache = PrefCache(stored_prefs, Game.PREF)
 
 
 def set_prefs(nick, **kwargs):
@@ -350,34 +322,28 @@ def set_prefs(nick, **kwargs):
     :param nick:
     :param kwargs: fg, bg, label
     """
-    for user in db_handler.data:
-        if nick == user[db_columns[0]]:
-            data = json.loads(user.get("prefs"))
-            data.update(kwargs)
-            user.update({"prefs": json.dumps(data)})
-            db_handler.update(user["id"], user)
-            return True
-    default = Game.PREF
-    default.update(kwargs)
-    db_handler.push(
-        {
-            "nick": nick,
-            "checkmates": 0,
-            "stalemates": 0,
-            "draws": 0,
-            "games": 0,
-            "losses": 0,
-            "prefs": json.dumps(default),
-        }
-    )
-    return False
+    user = get_data(nick)
+    data = json.loads(user["prefs"]) if user else dict(Game.PREF)
+    data.update(kwargs)
+    players.update(nick, prefs=json.dumps(data))
+    pref_cache.invalidate(nick)
+    return user is not None
 
 
 class BotState:
-    def __init__(self):
-        self.games = {}  # {nick: {channel: {selected: index, games: [game1, game2]},..}, ...}
+    def __init__(self, scheduler: DeadlineScheduler, notify):
+        """__init__.
+
+        :param scheduler: Fires invite and undo request expirations.
+        :param notify: Async function (message, channel) used to tell players about expirations.
+        """
+        self.games = {}  # {(channel, frozenset({nick1, nick2})): game}
+        self.nick_games = {}  # {nick: {channel: {against_nick: game}}} in creation order
+        self.selected = {}  # {nick: {channel: against_nick}}
         self.invites = {}  # {nick: {channel: {nick1: time,  nick2: time },channel2 ...}}
         self.undo_requests = {}  # {nick: {channel: {nick: time}}}
+        self.scheduler = scheduler
+        self.notify = notify
 
     def request_undo(self, nick, against_nick, channel):
         if not self.has_game_with(nick, against_nick, channel):
@@ -387,8 +353,27 @@ class BotState:
         if channel not in self.undo_requests[against_nick]:
             self.undo_requests[against_nick][channel] = {}
         self.undo_requests[against_nick][channel][nick] = datetime.now().timestamp()
+        self.scheduler.schedule(
+            ("undo", nick, against_nick, channel),
+            EXPIRE_REQUEST_TIME,
+            self._expire_undo,
+            nick,
+            against_nick,
+            channel,
+        )
         return True
 
+    async def _expire_undo(self, nick, against_nick, channel):
+        if self.undo_requests.get(against_nick, {}).get(channel, {}).pop(nick, None):
+            await self.notify(
+                f"<{nick}> Your undo request to {against_nick} has expired!", channel
+            )
+
+    def _clear_undo(self, nick, against_nick, channel):
+        for a, b in [(nick, against_nick), (against_nick, nick)]:
+            self.undo_requests.get(b, {}).get(channel, {}).pop(a, None)
+            self.scheduler.cancel(("undo", a, b, channel))
+
     def undo(self, nick, against_nick, channel):
         game = self.has_game_with(nick, against_nick, channel)
         if not game:
@@ -401,6 +386,7 @@ class BotState:
         ):
             time = self.undo_requests[against_nick][channel][nick]
             del self.undo_requests[against_nick][channel][nick]
+            self.scheduler.cancel(("undo", nick, against_nick, channel))
             if datetime.now().timestamp() - time < EXPIRE_REQUEST_TIME:
                 return True
             return False
@@ -419,98 +405,120 @@ class BotState:
         if channel not in self.invites[against_nick]:
             self.invites[against_nick][channel] = {}
         self.invites[against_nick][channel][nick] = datetime.now().timestamp()
+        self.scheduler.schedule(
+            ("invite", nick, against_nick, channel),
+            EXPIRE_INVITE_IN,
+            self._expire_invite,
+            nick,
+            against_nick,
+            channel,
+        )
         return True
 
+    async def _expire_invite(self, nick, against_nick, channel):
+        if self.remove_invite(nick, against_nick, channel):
+            await self.notify(
+                f"<{nick}> Your game request to {against_nick} has expired!", channel
+            )
+
     def remove_invite(self, nick, against_nick, channel):
         if self.has_invited(nick, against_nick, channel):
             self.invites[against_nick][channel].pop(nick)
+            self.scheduler.cancel(("invite", nick, against_nick, channel))
             return True
         return None
 
+    @staticmethod
+    def _key(nick, against_nick, channel):
+        return (channel, frozenset((nick, against_nick)))
+
     def _add_game(self, nick, against_nick, channel, new_game):
-        if nick not in self.games:
-            self.games[nick] = {}
-        if channel not in self.games[nick]:
-            self.games[nick][channel] = {"selected": 0, "games": []}
-        self.games[nick][channel]["games"].append(new_game)
-        self.games[nick][channel][
-            "selected"
-        ] = -1  # len(self.games[nick][channel]['games']) - 1
-
-    def add_game(self, nick, against_nick, channel, check_invitation=True):
+        if nick not in self.nick_games:
+            self.nick_games[nick] = {}
+            self.selected[nick] = {}
+        if channel not in self.nick_games[nick]:
+            self.nick_games[nick][channel] = {}
+        self.nick_games[nick][channel][against_nick] = new_game
+        self.selected[nick][channel] = against_nick
+
+    def _remove_game(self, nick, against_nick, channel):
+        games = self.nick_games[nick][channel]
+        del games[against_nick]
+        if self.selected[nick].get(channel) == against_nick:
+            if games:
+                # Fall back to the most recent game
+                self.selected[nick][channel] = next(reversed(games))
+            else:
+                del self.selected[nick][channel]
+        if not games:
+            del self.nick_games[nick][channel]
+        if not self.nick_games[nick]:
+            del self.nick_games[nick]
+            del self.selected[nick]
+
+    def add_game(
+        self, nick, against_nick, channel, check_invitation=True, moves=None, fen=None
+    ):
         if check_invitation and (
             against_nick != NICK and not self.remove_invite(nick, against_nick, channel)
         ):
             return None
-        new_game = Game(nick, against_nick)
+        new_game = Game(nick, against_nick, moves, fen)
+        self.games[self._key(nick, against_nick, channel)] = new_game
         self._add_game(nick, against_nick, channel, new_game)
         self._add_game(against_nick, nick, channel, new_game)
         return new_game
 
     def has_any_game(self, nick, channel):
-        return (
-            nick in self.games
-            and channel in self.games[nick]
-            and len(self.games[nick][channel]["games"]) > 0
-        )
+        return bool(self.nick_games.get(nick, {}).get(channel))
 
     def has_game_with(self, nick, against_nick, channel):
-        if not self.has_any_game(nick, channel):
-            return None
-        for game in self.games[nick][channel]["games"]:
-            if nick in [game.p1, game.p2] and game.other(nick) == against_nick:
-                return game
-        return None
+        return self.games.get(self._key(nick, against_nick, channel))
 
     def get_games(self, nick, channel=None):
         if channel and self.has_any_game(nick, channel):
-            return self.games[nick][channel]["games"]
-        if not channel and nick in self.games:
-            games = []
-            for chan in self.games[nick]:
-                games += self.games[nick][chan]["games"]
-            return games
+            return list(self.nick_games[nick][channel].values())
+        if not channel and nick in self.nick_games:
+            return [
+                game
+                for games in self.nick_games[nick].values()
+                for game in games.values()
+            ]
         return None
 
     def get_selected_game(self, nick, channel):
-        if not self.has_any_game(nick, channel):
+        against_nick = self.selected.get(nick, {}).get(channel)
+        if against_nick is None:
             return None
-        games = self.games[nick][channel]
-        return games["games"][games["selected"]]
+        return self.has_game_with(nick, against_nick, channel)
 
     def select_game(self, nick, against_nick, channel):
-        games = self.get_games(nick, channel)
-        if games:
-            for game in games:
-                if game.other(nick) == against_nick:
-                    self.games[nick][channel]["selected"] = self.games[nick][channel][
-                        "games"
-                    ].index(game)
-                    return game
-        return None
+        game = self.has_game_with(nick, against_nick, channel)
+        if game:
+            self.selected[nick][channel] = against_nick
+        return game
 
     def end_game(self, nick, against_nick, channel):
-        game: Game = self.has_game_with(nick, against_nick, channel)
+        game: Game = self.games.pop(self._key(nick, against_nick, channel), None)
         if game is None:
             return None
-        if (
-            self.games[nick][channel]["games"][self.games[nick][channel]["selected"]]
-            == game
-        ):
-            self.games[nick][channel]["selected"] = -1
-        self.games[nick][channel]["games"].remove(game)
-        self.end_game(against_nick, nick, channel)
+        self._remove_game(nick, against_nick, channel)
+        self._remove_game(against_nick, nick, channel)
+        self._clear_undo(nick, against_nick, channel)
+        engine_pool.cancel_ponder(self._key(nick, against_nick, channel))
         return True
 
 
 # IRC Bot commands
 
-botState = BotState()
+scheduler = DeadlineScheduler()
+members = ChannelMembers()
+botState = BotState(scheduler, bot.send_message)
 
 
 def print_board(args, message: Message, notsave=False):
     nick = message.nick
-    if nick not in botState.games:
+    if nick not in botState.nick_games:
         return "You aren't currently in any game. Type start [nick] to start a new game with a player"
 
     game = botState.get_selected_game(nick, message.channel)
@@ -520,7 +528,7 @@ def print_board(args, message: Message, notsave=False):
 
 
 async def start(bot, args, message):
-    names = await bot.list_names(message.channel)
+    names = members.names(message.channel)
     nick = message.nick
     if not args[1]:
         return f"<{message.nick}> Usage: {PREFIX}start [nick] or start {NICK} to play against the cpu."
@@ -568,7 +576,7 @@ def score(args, message):
             else f"<{message.nick}> I don't know nothing about {nick} yet...."
         )
     data.pop("prefs")
-    data.pop("id")
+    data.pop("id", None)
     data.pop("nick")
     data["unfinished"] = (
         data["games"]
@@ -577,34 +585,43 @@ def score(args, message):
         - data["draws"]
         - data["losses"]
     )
+    data["rating"] = round(ratings.get(nick))
     return f"<{nick}> has: {', '.join([f'{n}: {v}' for n,v in data.items()])}"
 
 
-def getMoves(uic, board):
-    possible_moves = [m.uci() for m in list(board.legal_moves)]
-    r_moves = []
-    for mov in possible_moves:
-        if mov.startswith(uic.lower()):
-            r_moves.append(mov)
-    return r_moves
+def top(args, message):
+    n, scope = 10, message.channel
+    for arg in args[1:3]:
+        if not arg:
+            continue
+        if arg.isdigit():
+            n = min(int(arg), 25)
+        elif arg == "global":
+            scope = GLOBAL
+        else:
+            scope = arg
+    leaders = ratings.top(n, scope)
+    where = scope or "all channels"
+    if not leaders:
+        return f"<{message.nick}> There are no rated games on {where} yet."
+    return [f"Top {len(leaders)} on {where}:"] + [
+        f"{i + 1}. {nick} {round(rating)}" for i, (nick, rating) in enumerate(leaders)
+    ]
 
 
-async def move(bot, args, message):
-    try:
-        uci = chess.Move.from_uci(args[1])
-    except ValueError:
-        uci = None
+def getMoves(uic, game: Game):
+    return game.table.starting_with(uic)
 
+
+async def move(bot, args, message):
     game: Game = botState.get_selected_game(message.nick, message.channel)
-    chan_names = await bot.list_names(message.channel)
     if game is None:
         return f"<{message.nick}> You don't have any game selected"
     if game.nicks[game.player] != message.nick:
         return f"<{message.nick}> It is not your move!"
-    board = game.board
-    if uci not in board.legal_moves:
+    if args[1] not in game.table:
         if args[1] and len(args[1]) == 2 and re.match(r"^[a-h][1-8]$", args[1]):
-            p_moves = getMoves(args[1], board)
+            p_moves = getMoves(args[1], game)
             if len(p_moves) == 0:
                 return f"<{message.nick}> There are no possible moves for {args[1]}"
             return (
@@ -617,57 +634,58 @@ async def move(bot, args, message):
     if game.nicks[game.player] != NICK:
         update_game(game.p1, game.p2, message.channel, game)
 
-    def endGame(msg, nick):
-        boards = game.utf8_board(game.p1) + game.utf8_board(game.p2)
-        botState.end_game(nick, game.nicks[game.player], message.channel)
-        return [msg] + boards + [f"{nick} wins"]
-
-    def checkBoard(nick=None):
-        if board.is_game_over():
-            nick = nick if nick is not None else message.nick
-            against_nick = game.nicks[game.player]
-            if board.is_variant_draw():
-                increment_data(game.p1, "draws")
-                increment_data(game.p2, "draws")
-                delete_game(game.p1, game.p2, message.channel, game)
-                return endGame("DRAW!", nick)
-            if board.is_stalemate():
-                increment_data(nick, "stalemates")
-                increment_data(against_nick, "losses")
-                delete_game(game.p1, game.p2, message.channel, game)
-                return endGame("STALEMATE!", nick)
-            if board.is_checkmate():
-                increment_data(nick, "checkmates")
-                increment_data(against_nick, "losses")
-                delete_game(game.p1, game.p2, message.channel, game)
-                return endGame("CHECKMATE!", nick)
-            increment_data(nick, "checkmates")
-            increment_data(against_nick, "losses")
-            delete_game(game.p1, game.p2, message.channel, game)
-            boards = game.utf8_board(game.p1) + game.utf8_board(game.p2)
-            botState.end_game(nick, against_nick, message.channel)
-            return ["END..."] + boards
-
-    end = checkBoard()
+    end = checkBoard(game, message.channel, message.nick)
     if end:
         return end
 
     if game.nicks[game.player] == NICK:
-        if board.is_check():
-            b1 = ["CHECK"]
-            b1 += game.utf8_board(game.nicks[game.player])
-        else:
-            b1 = game.utf8_board(game.nicks[game.player])
+        # Answer from a background task so the irc loop keeps reading while
+        # the engine pool thinks
+        task = asyncio.create_task(cpuReply(bot, game, message))
+        cpu_tasks.add(task)
+        task.add_done_callback(cpu_tasks.discard)
+        return
 
-        uic = cpuPlay(game.board)
-        game.player = not game.player
-        game.history.append(uic)
-        update_game(game.p1, game.p2, message.channel, game)
-        end = checkBoard(NICK)
-        if end:
-            return end
+    return turnMessage(game, message, members.names(message.channel))
+
+
+def checkBoard(game: Game, channel, nick):
+    termination = game.table.termination
+    if termination is None:
+        return None
+
+    against_nick = game.nicks[game.player]
+
+    def endGame(msg):
+        boards = game.utf8_board(game.p1) + game.utf8_board(game.p2)
+        botState.end_game(nick, against_nick, channel)
+        return [msg] + boards + [f"{nick} wins"]
 
-    if board.is_check():
+    if termination == chess.Termination.VARIANT_DRAW:
+        increment_data(game.p1, "draws")
+        increment_data(game.p2, "draws")
+        delete_game(game.p1, game.p2, channel, game)
+        return endGame("DRAW!")
+    if termination == chess.Termination.STALEMATE:
+        increment_data(nick, "stalemates")
+        increment_data(against_nick, "losses")
+        delete_game(game.p1, game.p2, channel, game)
+        return endGame("STALEMATE!")
+    if termination == chess.Termination.CHECKMATE:
+        increment_data(nick, "checkmates")
+        increment_data(against_nick, "losses")
+        delete_game(game.p1, game.p2, channel, game)
+        return endGame("CHECKMATE!")
+    increment_data(nick, "checkmates")
+    increment_data(against_nick, "losses")
+    delete_game(game.p1, game.p2, channel, game)
+    boards = game.utf8_board(game.p1) + game.utf8_board(game.p2)
+    botState.end_game(nick, against_nick, channel)
+    return ["END..."] + boards
+
+
+def turnMessage(game: Game, message, chan_names):
+    if game.table.is_check:
         return (
             ["CHECK"]
             + [f"It is {game.who()}'s turn!"]
@@ -682,6 +700,40 @@ async def move(bot, args, message):
         return f"Do not worry {message.nick}; you can still move. {game.who()} will be notified when he is back!"
 
 
+cpu_tasks = set()
+
+
+async def cpuReply(bot, game: Game, message):
+    board = game.board
+    ply = len(board.move_stack)
+    try:
+        uic = await cpuPlay(
+            board, message.channel, BotState._key(game.p1, game.p2, message.channel)
+        )
+    except (chess.engine.EngineError, asyncio.TimeoutError) as e:
+        log(f"CPU move failed: {e!r}")
+        if len(board.move_stack) == ply:
+            game.pop()
+        await bot.send_message(
+            f"<{message.nick}> The cpu could not answer your move, it was taken back. Try again in a moment.",
+            message.channel,
+        )
+        return
+    if (
+        len(board.move_stack) != ply
+        or botState.has_game_with(game.p1, game.p2, message.channel) is not game
+    ):
+        # The game was undone or ended while the engine was thinking
+        return
+
+    game.move(uic)
+    update_game(game.p1, game.p2, message.channel, game)
+    reply = checkBoard(game, message.channel, NICK)
+    if not reply:
+        reply = turnMessage(game, message, members.names(message.channel))
+    await bot.send_message(reply, message.channel)
+
+
 def label(args, message):
     if not args[1] or not args[1].isdigit():
         return f"<{message.nick}> Usage: {PREFIX}label [1|2]"
@@ -753,16 +805,14 @@ def hint(args, message):
     game: Game = botState.get_selected_game(message.nick, message.channel)
     if game is None:
         return f"<{message.nick}> You don't have any game selected"
-    board = game.board
     if args[1] and len(args[1]) == 2:
         return (
             f"({message.nick}) possible moves for {args[1].lower()} are: "
-            + ", ".join(getMoves(args[1], board))
+            + ", ".join(getMoves(args[1], game))
         )
     if args[1]:
         return "Pass in a board position like: hint e2, or no arguments to see all possible moves"
-    possible_moves = [m.uci() for m in list(board.legal_moves)]
-    return f"({message.nick}) possible moves are: " + ", ".join(possible_moves)
+    return f"({message.nick}) possible moves are: " + ", ".join(game.table.moves)
 
 
 def undo(args, message):
@@ -783,6 +833,10 @@ def undo(args, message):
         return f"<{message.nick}> The undo request has expired. Repeat the command if you want to undo again."
 
     if against_nick == NICK:
+        if game.who() == NICK:
+            return f"<{message.nick}> Wait for the cpu to answer your move before undoing it"
+        if len(game.moves) < 2:
+            return f"<{message.nick}> There is nothing to undo"
         game.pop()
         game.pop()
         update_game(game.p1, game.p2, message.channel, game)
@@ -850,11 +904,11 @@ def forfeit(args, message):
         if is_onwer:
             increment_data(message.sender_nick, "losses")
             increment_data(against_nick, "stalemates")
-            delete_game(message.sender_nick, against_nick, message.channel, game)
+            delete_game(message.sender_nick, against_nick, message.channel, game, "0-1")
         else:
             increment_data(message.sender_nick, "losses")
             increment_data(against_nick, "stalemates")
-            delete_game(against_nick, message.sender_nick, message.channel, game)
+            delete_game(against_nick, message.sender_nick, message.channel, game, "1-0")
         return f"<{against_nick}> {message.sender_nick} forfeits, you win!"
     return f"<{message.sender_nick}> Could not remove game {game.p1} vs {game.p2}"
 
@@ -899,9 +953,8 @@ def history(args, message):
 
 
 @bot.arg_command("names", "Lists users on this room", "")
-async def list_names(args, message):
-    names = await bot.list_names(message.channel)
-    return " ".join(names)
+def list_names(args, message):
+    return " ".join(sorted(members.names(message.channel)))
 
 
 @bot.arg_command("games", "Current games", "Displays your current games.")
@@ -922,6 +975,95 @@ def games(args, message):
     )
 
 
+@bot.arg_command(
+    "archive",
+    "Finished games",
+    f"{PREFIX}archive [nick|#channel]. Lists the latest finished games, see {PREFIX}replay",
+)
+def archived(args, message):
+    target = args[1] or message.sender_nick
+    if target.startswith("#"):
+        games = archive.recent(channel=target)
+    else:
+        games = archive.recent(player=target)
+    if not games:
+        return f"<{message.sender_nick}> I found no finished games for {target}."
+    return [f"<{message.sender_nick}> Latest finished games of {target}:"] + [
+        f"#{g.id} {g.white} vs {g.black} {g.result} ({g.date} {g.channel})"
+        for g in games
+    ]
+
+
+@bot.arg_command("replay", "Replays a finished game", f"{PREFIX}replay [game id]")
+def replay(args, message):
+    id = (args[1] or "").lstrip("#")
+    entry = archive.get(int(id)) if id.isdigit() else None
+    if entry is None:
+        return f"<{message.sender_nick}> Usage: {PREFIX}replay [game id]. See {PREFIX}archive"
+    pgn = chess.pgn.read_game(io.StringIO(archive.pgn(entry)))
+    movetext = pgn.accept(chess.pgn.StringExporter(headers=False, columns=None))
+    board = pgn.end().board()
+    return (
+        [
+            f"<{message.sender_nick}> #{entry.id} {entry.white} vs {entry.black} ({entry.date} {entry.channel})"
+        ]
+        + textwrap.wrap(movetext, 400)
+        + render_profile(board.board_fen(), pref_cache.profile(message.sender_nick))
+    )
+
+
+@bot.arg_command(
+    "analyze",
+    "Finds the blunders of a game",
+    f"{PREFIX}analyze [game id]. Analyzes your selected game, or the given or your last finished one",
+)
+def analyze(args, message):
+    nick = message.sender_nick
+    game = None if args[1] else botState.get_selected_game(nick, message.channel)
+    if game is not None:
+        white, black, moves = game.p1, game.p2, game.history
+    else:
+        id = (args[1] or "").lstrip("#")
+        if id.isdigit():
+            entry = archive.get(int(id))
+        else:
+            entry = next(iter(archive.recent(player=nick, n=1)), None)
+        if entry is None:
+            return f"<{nick}> There is no game to analyze. Usage: {PREFIX}analyze [game id]"
+        pgn = chess.pgn.read_game(io.StringIO(archive.pgn(entry)))
+        white, black = entry.white, entry.black
+        moves = [m.uci() for m in pgn.mainline_moves()]
+    if not moves:
+        return f"<{nick}> There are no moves to analyze yet."
+
+    task = asyncio.create_task(analyzeReply(white, black, moves, message))
+    cpu_tasks.add(task)
+    task.add_done_callback(cpu_tasks.discard)
+    return f"<{nick}> Analyzing {len(moves)} moves of {white} vs {black}..."
+
+
+async def analyzeReply(white, black, moves, message):
+    nick = message.sender_nick
+    judgements = []
+    try:
+        async for judgement in analyzer.judge(moves):
+            judgements.append(judgement)
+            # Only moves worth a remark, so long games don't flood the channel
+            if judgement.label:
+                await bot.send_message(f"<{nick}> {judgement}", message.channel)
+    except Exception as e:
+        log(f"Analysis failed: {e!r}")
+        await bot.send_message(
+            f"<{nick}> The analysis failed, try again later.",
+            message.channel,
+        )
+        return
+    await bot.send_message(
+        [f"<{nick}> {white} vs {black}:"] + summarize(judgements, white, black),
+        message.channel,
+    )
+
+
 @bot.arg_command("select", "Select/change between games", f"{PREFIX}select [nick]")
 def select(args, message):
     if not args[1]:
@@ -932,8 +1074,26 @@ def select(args, message):
     return game.utf8_board(message.sender_nick)
 
 
+@bot.custom_handler("names")
+def onNames(channel, names):
+    members.seed(channel, names)
+
+
+def onNick(nick, nickchange):
+    members.rename(nick, nickchange)
+
+
+# The library parses nick changes but its decorator doesn't accept them
+bot.custom_handlers["nickchange"] = onNick
+
+
 @bot.custom_handler(["part", "quit"])
 async def onQuit(nick, channel=None, text=""):
+    if channel is None:
+        members.quit(nick)
+    else:
+        members.part(nick, channel)
+
     async def notifyPlayers(chan):
         games = botState.get_games(nick, chan)
         players = [g.other(nick) for g in games]
@@ -945,14 +1105,9 @@ async def onQuit(nick, channel=None, text=""):
             )
 
     if channel is None:  # quit
-        games = botState.get_games(nick)
-        if not games:
-            return
-        for chan in botState.games[nick]:
-            for game in games:
-                if game in botState.games[nick][chan]["games"]:
-                    if game.nicks[game.player] == game.other(nick):
-                        await notifyPlayers(chan)
+        for chan, games in list(botState.nick_games.get(nick, {}).items()):
+            if any(game.who() == game.other(nick) for game in games.values()):
+                await notifyPlayers(chan)
 
     if botState.has_any_game(nick, channel):
         await notifyPlayers(channel)
@@ -961,7 +1116,11 @@ async def onQuit(nick, channel=None, text=""):
 @bot.custom_handler("join")
 def onEnter(nick, channel):
     if nick == NICK:  # Ignore myself ;)
+        # The NAMES reply that follows our own join seeds the members again
+        members.reset(channel)
+        members.join(nick, channel)
         return
+    members.join(nick, channel)
     if botState.has_any_game(nick, channel):
         games = botState.get_games(nick, channel)
         msg = []
@@ -979,23 +1138,17 @@ def onEnter(nick, channel):
         return Message(channel, message=msg)
 
 
-def load_game(nick, against_nick, channel, moves):
+def load_game(nick, against_nick, channel, moves, fen=None):
     debug(f"Loading {nick}")
-    game = botState.add_game(nick, against_nick, channel, check_invitation=False)
-    for m in moves:
-        game.move(m)
+    botState.add_game(
+        nick, against_nick, channel, check_invitation=False, moves=moves, fen=fen
+    )
 
 
 def load_games():
-    for user in db_handler.data:
-        ongoing_games = load_ongoing_games()
-        nick = user[db_columns[0]]
-        if nick not in ongoing_games:
-            continue
-        for channel in ongoing_games[nick]:
-            for against_nick in ongoing_games[nick][channel]:
-                moves = ongoing_games[nick][channel][against_nick]
-                load_game(nick, against_nick, channel, moves)
+    ongoing_games = load_ongoing_games()
+    for (channel, nick, against_nick), stored in ongoing_games.items():
+        load_game(nick, against_nick, channel, stored.moves, stored.fen)
 
 
 async def on_run(bot: IrcBot):
@@ -1013,21 +1166,7 @@ async def on_run(bot: IrcBot):
             Color("CHESS BOT INITIALIZED", Color.light_green, Color.black).str
         )
 
-    while True:
-        for nick in botState.invites:
-            for channel in botState.invites[nick]:
-                for against_nick in deepcopy(botState.invites[nick][channel]):
-                    now = datetime.now().timestamp()
-                    if (
-                        now - botState.invites[nick][channel][against_nick]
-                        > EXPIRE_INVITE_IN
-                    ):
-                        botState.invites[nick][channel].pop(against_nick)
-                        await bot.send_message(
-                            f"<{against_nick}> Your game request to {nick} has expired!",
-                            channel,
-                        )
-        await bot.sleep(0.5)
+    await scheduler.run()
 
 
 ##################################################
@@ -1084,6 +1223,17 @@ def score_cmd(args, message):
     return score(args, message)
 
 
+@bot.arg_command("engine", "Engine workers status", "")
+def engine_cmd(args, message):
+    stats = engine_pool.stats()
+    return f"<{message.nick}> " + ", ".join(f"{k}: {v}" for k, v in stats.items())
+
+
+@bot.arg_command("top", "Best rated players", f"{PREFIX}top [N] [#channel|global]")
+def top_cmd(args, message):
+    return top(args, message)
+
+
 @bot.arg_command(
     "label", "Changes the top and bottom row of letters", f"{PREFIX}label [1|2]"
 )
@@ -1117,8 +1267,52 @@ def client_cmd(args, message):
 async def on_connect():
     for channel in CHANNELS:
         await bot.join(channel)
+    await engine_pool.start()
+    players.start_flushing(FLUSH_PLAYERS_EVERY)
+    move_cache.start_saving(SAVE_MOVE_CACHE_EVERY)
+    ratings.start_saving(SAVE_RATINGS_EVERY)
     await on_run(bot)
 
 
+async def save_state():
+    """Writes what the periodic savers haven't written yet."""
+    await players.flush()
+    for name, save in [("ratings", ratings.save), ("move cache", move_cache.save)]:
+        try:
+            await save()
+        except OSError as e:
+            log(f"Failed to save {name}: {e!r}")
+
+
+async def close_engines():
+    await engine_pool.close()
+    analyzer.close()
+
+
+async def main():
+    loop = asyncio.get_running_loop()
+    task = asyncio.current_task()
+
+    def stop():
+        bot.self_closed = True
+        task.cancel()
+
+    # pm2 stops the bot with SIGINT, kill sends SIGTERM
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stop)
+    try:
+        # What run_with_callback runs, but in a loop the engines can still be
+        # closed in once the bot stops
+        await bot._mainloop(on_connect)
+    except asyncio.CancelledError:
+        pass
+    finally:
+        log("Saving state before exiting")
+        await save_state()
+        await close_engines()
+        if bot.stream is not None:
+            await bot.stream.aclose()
+
+
 if __name__ == "__main__":
-    bot.run_with_callback(on_connect)
+    asyncio.run(main())
@@ -0,0 +1,43 @@
+class ChannelMembers:
+    PREFIXES = "~&%@+"
+
+    def __init__(self):
+        """Nicks present on each channel, kept up to date from NAMES replies
+        and join, part, quit and nick change events.
+
+        bot.list_names can't be used for this: the library replaces a
+        channel's names with every 353 line, so only the last line of a long
+        NAMES reply is kept, and it stores nicks with their mode prefix, so
+        parts, quits and nick changes of ops and voiced users never match.
+        """
+        self.channels: dict[str, set[str]] = {}
+
+    def __contains__(self, channel: str) -> bool:
+        return channel in self.channels
+
+    def names(self, channel: str) -> set[str]:
+        return self.channels.get(channel, set())
+
+    def seed(self, channel: str, names: list[str]):
+        self.channels.setdefault(channel, set()).update(
+            name.lstrip(self.PREFIXES) for name in names
+        )
+
+    def reset(self, channel: str):
+        self.channels[channel] = set()
+
+    def join(self, nick: str, channel: str):
+        self.channels.setdefault(channel, set()).add(nick)
+
+    def part(self, nick: str, channel: str):
+        self.channels.get(channel, set()).discard(nick)
+
+    def quit(self, nick: str):
+        for names in self.channels.values():
+            names.discard(nick)
+
+    def rename(self, nick: str, new_nick: str):
+        for names in self.channels.values():
+            if nick in names:
+                names.discard(nick)
+                names.add(new_nick)
@@ -0,0 +1,179 @@
+import asyncio
+import json
+import os
+from collections import OrderedDict
+
+import chess
+import chess.polyglot
+import chess.syzygy
+from ircbot.utils import debug, log
+
+
+class MoveCache:
+    def __init__(self, path: str, maxsize: int = 100_000):
+        """LRU of engine moves keyed by the zobrist hash of the position and
+        the time the engine was given, saved to a json file.
+
+        :param path: File to persist the cache to.
+        :param maxsize: Maximum number of positions kept.
+        """
+        self.path = path
+        self.maxsize = maxsize
+        self.moves: OrderedDict[str, str] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self._dirty = False
+        self._save_task = None
+
+    @staticmethod
+    def _key(board: chess.Board, time: float) -> str:
+        return f"{chess.polyglot.zobrist_hash(board):016x}:{time}"
+
+    def load(self):
+        try:
+            with open(self.path) as cache_file:
+                self.moves = OrderedDict(json.load(cache_file))
+        except FileNotFoundError:
+            debug("No move cache found")
+        except json.decoder.JSONDecodeError:
+            log("Ignoring move cache. Reason: File is corrupt")
+        while len(self.moves) > self.maxsize:
+            self.moves.popitem(last=False)
+        log(f"Loaded {len(self.moves)} cached positions")
+
+    def get(self, board: chess.Board, time: float) -> chess.Move | None:
+        key = self._key(board, time)
+        uci = self.moves.get(key)
+        if uci is not None:
+            move = chess.Move.from_uci(uci)
+            # Guard against hash collisions
+            if board.is_legal(move):
+                self.moves.move_to_end(key)
+                self.hits += 1
+                return move
+        self.misses += 1
+        return None
+
+    def put(self, board: chess.Board, time: float, move: chess.Move):
+        self.moves[self._key(board, time)] = move.uci()
+        if len(self.moves) > self.maxsize:
+            self.moves.popitem(last=False)
+        self._dirty = True
+
+    async def save(self):
+        if not self._dirty:
+            return
+        self._dirty = False
+        try:
+            await asyncio.to_thread(self._write, dict(self.moves))
+        except BaseException:
+            self._dirty = True
+            raise
+
+    def _write(self, moves: dict):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as cache_file:
+            json.dump(moves, cache_file)
+        os.replace(tmp_path, self.path)
+        debug(f"Saved {len(moves)} cached positions")
+
+    def start_saving(self, interval: float):
+        if self._save_task is None:
+            self._save_task = asyncio.create_task(self._save_loop(interval))
+
+    async def _save_loop(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.save()
+            except OSError as e:
+                log(f"Failed to save move cache: {e!r}")
+
+
+class OpeningBook:
+    def __init__(self, path: str | None):
+        """Optional polyglot opening book.
+
+        :param path: Path to a .bin polyglot book. Disabled if None or missing.
+        """
+        self.reader = None
+        if not path:
+            return
+        try:
+            self.reader = chess.polyglot.open_reader(path)
+            log(f"Using opening book {path}")
+        except OSError as e:
+            log(f"Opening book disabled. Reason: {e!r}")
+
+    def move(self, board: chess.Board) -> chess.Move | None:
+        if self.reader is None:
+            return None
+        try:
+            return self.reader.weighted_choice(board).move
+        except IndexError:
+            return None
+
+
+class Tablebase:
+    def __init__(self, path: str | None):
+        """Optional Syzygy endgame tablebases.
+
+        :param path: Directory with .rtbw and .rtbz files. Disabled if None or
+            no table could be opened.
+        """
+        self.reader = None
+        self.max_pieces = 0
+        if not path:
+            return
+        try:
+            reader = chess.syzygy.open_tablebase(path)
+        except OSError as e:
+            log(f"Tablebases disabled. Reason: {e!r}")
+            return
+        # Table names look like KQvKR
+        names = set(reader.wdl) & set(reader.dtz)
+        if not names:
+            log(f"Tablebases disabled. Reason: No tables in {path}")
+            reader.close()
+            return
+        self.reader = reader
+        self.max_pieces = max(len(name) - 1 for name in names)
+        log(f"Using {len(names)} tablebases up to {self.max_pieces} pieces from {path}")
+
+    def covers(self, board: chess.Board) -> bool:
+        return (
+            self.reader is not None
+            and chess.popcount(board.occupied) <= self.max_pieces
+            and not board.castling_rights
+        )
+
+    def move(self, board: chess.Board) -> chess.Move | None:
+        """Best move according to the tables, or None when the position is
+        not covered."""
+        if not self.covers(board):
+            return None
+        board = board.copy(stack=False)
+        best, best_key = None, None
+        try:
+            for move in list(board.legal_moves):
+                zeroing = board.is_zeroing(move)
+                board.push(move)
+                if board.is_checkmate():
+                    return move
+                # Both probes are from the opponent's point of view
+                wdl = -self.reader.probe_wdl(board)
+                dtz = abs(self.reader.probe_dtz(board))
+                board.pop()
+                if wdl > 0:
+                    # Win: reset the fifty move counter or get closer to it
+                    key = (wdl, zeroing, -dtz)
+                elif wdl < 0:
+                    key = (wdl, False, dtz)
+                else:
+                    key = (wdl, False, 0)
+                if best_key is None or key > best_key:
+                    best, best_key = move, key
+        except KeyError:
+            # MissingTableError
+            return None
+        return best
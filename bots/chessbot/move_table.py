@@ -0,0 +1,59 @@
+import chess
+
+
+class MoveTable:
+    def __init__(self, board: chess.Board):
+        """Legal moves of a position generated once and grouped by the square
+        they start from, plus the way the game ended if it did.
+
+        :param board: Position to index. Not kept, the table is a snapshot.
+        """
+        self.moves: list[str] = []
+        self.by_square: dict[str, list[str]] = {}
+        for move in board.generate_legal_moves():
+            uci = move.uci()
+            self.moves.append(uci)
+            self.by_square.setdefault(uci[:2], []).append(uci)
+        self.legal = frozenset(self.moves)
+        self.is_check = board.is_check()
+        self.turn = board.turn
+        self.termination = self._termination(board)
+
+    def _termination(self, board: chess.Board) -> chess.Termination | None:
+        # Same rules as board.outcome() without generating the moves again
+        if not self.moves:
+            return (
+                chess.Termination.CHECKMATE
+                if self.is_check
+                else chess.Termination.STALEMATE
+            )
+        if board.is_insufficient_material():
+            return chess.Termination.INSUFFICIENT_MATERIAL
+        if board.halfmove_clock >= 150:
+            return chess.Termination.SEVENTYFIVE_MOVES
+        if board.is_fivefold_repetition():
+            return chess.Termination.FIVEFOLD_REPETITION
+        return None
+
+    @property
+    def is_game_over(self) -> bool:
+        return self.termination is not None
+
+    @property
+    def result(self) -> str:
+        """PGN result of the position."""
+        if self.termination is None:
+            return "*"
+        if self.termination == chess.Termination.CHECKMATE:
+            return "0-1" if self.turn == chess.WHITE else "1-0"
+        return "1/2-1/2"
+
+    def __contains__(self, uci: str):
+        return uci in self.legal
+
+    def starting_with(self, prefix: str) -> list[str]:
+        """Legal moves whose uci starts with prefix, usually a square."""
+        prefix = prefix.lower()
+        if len(prefix) == 2:
+            return list(self.by_square.get(prefix, ()))
+        return [m for m in self.moves if m.startswith(prefix)]
@@ -0,0 +1,116 @@
+import asyncio
+import sqlite3
+
+from ircbot.client import PersistentData
+from ircbot.utils import debug, log
+
+
+class PlayerRepository:
+    def __init__(self, table: PersistentData, defaults: dict):
+        """In memory view of the users table indexed by nick. Changes are
+        applied to memory right away and written behind in a single sqlite
+        transaction by flush.
+
+        :param table: Users table. Only used to create the schema and for the first load.
+        :param defaults: Column values for new players.
+        """
+        self.table = table
+        self.columns = table.keys
+        self.defaults = defaults
+        self.rows: dict[str, dict] = {}
+        self._dirty: set[str] = set()
+        self._flush_lock = asyncio.Lock()
+        self._flush_task = None
+        for row in table.fetch():
+            self.rows.setdefault(row["nick"], row)
+        debug(f"Indexed {len(self.rows)} players")
+
+    def get(self, nick: str) -> dict | None:
+        return self.rows.get(nick)
+
+    def get_or_create(self, nick: str) -> dict:
+        if nick not in self.rows:
+            log("Creating player data")
+            self.rows[nick] = {**self.defaults, "nick": nick}
+            self._dirty.add(nick)
+        return self.rows[nick]
+
+    def update(self, nick: str, **changes) -> dict:
+        """Changes any number of columns of a player as a single write."""
+        row = self.get_or_create(nick)
+        row.update({k: v for k, v in changes.items() if k in self.columns})
+        self._dirty.add(nick)
+        return row
+
+    def increment(self, nick: str, *columns: str) -> dict:
+        row = self.get_or_create(nick)
+        return self.update(nick, **{c: row[c] + 1 for c in columns})
+
+    async def flush(self):
+        """Writes every changed player in one transaction off the event loop."""
+        async with self._flush_lock:
+            if not self._dirty:
+                return
+            nicks = list(self._dirty)
+            self._dirty.clear()
+            snapshot = [dict(self.rows[nick]) for nick in nicks]
+            written = False
+            try:
+                ids = await asyncio.to_thread(self._write, snapshot)
+                for nick, id in zip(nicks, ids):
+                    self.rows[nick]["id"] = id
+                written = True
+            except sqlite3.Error as e:
+                log(f"Failed to write players: {e!r}")
+                return
+            finally:
+                # Also when cancelled while the thread commits, the next flush
+                # then finds the inserted rows by nick
+                if not written:
+                    self._dirty.update(nicks)
+            debug(f"Flushed {len(nicks)} players")
+
+    def start_flushing(self, interval: float):
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_loop(interval))
+
+    async def _flush_loop(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            await self.flush()
+
+    def _write(self, rows: list[dict]) -> list[int]:
+        connection = sqlite3.connect(self.table.filename)
+        assignments = ", ".join(f"{c} = ?" for c in self.columns)
+        placeholders = ", ".join("?" for _ in self.columns)
+        ids = []
+        try:
+            with connection:
+                for row in rows:
+                    values = [row.get(c, "") for c in self.columns]
+                    if row.get("id") is None:
+                        # Inserted by a flush that was cancelled before
+                        # storing the id
+                        found = connection.execute(
+                            f"SELECT id FROM {self.table.name} WHERE nick = ?"
+                            " ORDER BY id LIMIT 1",
+                            [row["nick"]],
+                        ).fetchone()
+                        if found is not None:
+                            row["id"] = found[0]
+                    if row.get("id") is None:
+                        cursor = connection.execute(
+                            f"INSERT INTO {self.table.name} ({', '.join(self.columns)})"
+                            f" VALUES ({placeholders})",
+                            values,
+                        )
+                        ids.append(cursor.lastrowid)
+                    else:
+                        connection.execute(
+                            f"UPDATE {self.table.name} SET {assignments} WHERE id = ?",
+                            values + [row["id"]],
+                        )
+                        ids.append(row["id"])
+        finally:
+            connection.close()
+        return ids
@@ -0,0 +1,38 @@
+import json
+from typing import Callable
+
+from ircbot.utils import debug
+from render import Profile, profile_key
+
+
+class PrefCache:
+    def __init__(self, load: Callable[[str], str | None], default: dict):
+        """Decoded preferences and render profiles by nick. Entries are only
+        dropped by invalidate, which set_prefs calls on every change, so
+        steady state rendering never reads the player rows or parses json.
+
+        :param load: Returns the stored json preferences of a nick, or None.
+        :param default: Preferences of players without stored ones.
+        """
+        self.load = load
+        self.default = default
+        self.entries: dict[str, tuple[dict, Profile]] = {}
+
+    def _entry(self, nick: str) -> tuple[dict, Profile]:
+        entry = self.entries.get(nick)
+        if entry is None:
+            raw = self.load(nick)
+            prefs = json.loads(raw) if raw else self.default
+            entry = self.entries[nick] = (prefs, profile_key(prefs))
+            debug(f"Cached preferences of {nick}")
+        return entry
+
+    def get(self, nick: str) -> dict:
+        """Decoded preferences. Shared, so callers must not change them."""
+        return self._entry(nick)[0]
+
+    def profile(self, nick: str) -> Profile:
+        return self._entry(nick)[1]
+
+    def invalidate(self, nick: str):
+        self.entries.pop(nick, None)
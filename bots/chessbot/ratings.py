@@ -0,0 +1,117 @@
+import asyncio
+import json
+import os
+from bisect import bisect_left, insort
+
+from ircbot.utils import debug, log
+
+GLOBAL = ""  # Scope of the ratings across every channel
+
+
+class Leaderboard:
+    def __init__(self):
+        """Players of one scope kept sorted by rating, best first, so the top
+        N is a slice."""
+        self.ranking: list[tuple[float, str]] = []  # (-rating, nick)
+        self.ratings: dict[str, float] = {}
+
+    def set(self, nick: str, rating: float):
+        if nick in self.ratings:
+            old = (-self.ratings[nick], nick)
+            del self.ranking[bisect_left(self.ranking, old)]
+        self.ratings[nick] = rating
+        insort(self.ranking, (-rating, nick))
+
+    def top(self, n: int) -> list[tuple[str, float]]:
+        return [(nick, -rating) for rating, nick in self.ranking[:n]]
+
+
+class Ratings:
+    def __init__(self, path: str, initial: float = 1500, k: float = 32):
+        """Elo ratings per channel and globally, updated when a game ends and
+        saved to a json file.
+
+        :param path: File to persist the ratings to.
+        :param initial: Rating of a player without rated games.
+        :param k: Elo K factor.
+        """
+        self.path = path
+        self.initial = initial
+        self.k = k
+        self.boards: dict[str, Leaderboard] = {}
+        self._dirty = False
+        self._save_task = None
+
+    def load(self):
+        try:
+            with open(self.path) as ratings_file:
+                data = json.load(ratings_file)
+        except FileNotFoundError:
+            debug("No ratings found")
+            data = {}
+        except json.decoder.JSONDecodeError:
+            log("Ignoring ratings. Reason: File is corrupt")
+            data = {}
+        self.boards = {}
+        for scope, ratings in data.items():
+            board = self.board(scope)
+            for nick, rating in ratings.items():
+                board.set(nick, rating)
+        log(f"Loaded ratings of {len(self.board(GLOBAL).ratings)} players")
+
+    def board(self, scope: str) -> Leaderboard:
+        if scope not in self.boards:
+            self.boards[scope] = Leaderboard()
+        return self.boards[scope]
+
+    def get(self, nick: str, scope: str = GLOBAL) -> float:
+        board = self.boards.get(scope)
+        return board.ratings.get(nick, self.initial) if board else self.initial
+
+    def top(self, n: int, scope: str = GLOBAL) -> list[tuple[str, float]]:
+        board = self.boards.get(scope)
+        return board.top(n) if board else []
+
+    def record(self, channel: str, white: str, black: str, score: float):
+        """Updates both players in the channel and in the global ratings.
+
+        :param score: 1 if white won, 0.5 for a draw and 0 if black won.
+        """
+        for scope in [channel, GLOBAL]:
+            board = self.board(scope)
+            w, b = self.get(white, scope), self.get(black, scope)
+            expected = 1 / (1 + 10 ** ((b - w) / 400))
+            change = self.k * (score - expected)
+            board.set(white, w + change)
+            board.set(black, b - change)
+        self._dirty = True
+
+    async def save(self):
+        if not self._dirty:
+            return
+        self._dirty = False
+        data = {scope: dict(board.ratings) for scope, board in self.boards.items()}
+        try:
+            await asyncio.to_thread(self._write, data)
+        except BaseException:
+            self._dirty = True
+            raise
+
+    def _write(self, data: dict):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as ratings_file:
+            json.dump(data, ratings_file)
+        os.replace(tmp_path, self.path)
+        debug("Saved ratings")
+
+    def start_saving(self, interval: float):
+        if self._save_task is None:
+            self._save_task = asyncio.create_task(self._save_loop(interval))
+
+    async def _save_loop(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.save()
+            except OSError as e:
+                log(f"Failed to save ratings: {e!r}")
@@ -0,0 +1,119 @@
+from functools import lru_cache
+
+from ircbot.format import Color
+
+RENDER_CACHE_SIZE = 4096
+PIECES = "PNBRQKpnbrqk."
+SEP = " \003 "
+
+REMAP = {
+    "R": "♜",
+    "N": "♞",
+    "B": "♝",
+    "Q": "♛",
+    "K": "♚",
+    "P": "♟︎",
+    ".": "♟︎",
+}
+
+BMODES = {
+    "normal": {"pieces": [1, 1], "pawns": [1, 1], "remap": {}},
+    "wide": {
+        "remap": {".": "♟", "P": "♟"},
+        "pieces": [2, 2],
+        "pawns": [2, 2],
+        "prefs": {"label": "    A     B     C    D     E     F     G     H"},
+    },
+    "erc": {
+        "remap": {".": "♟", "P": "♟"},
+        "pieces": [1, 1],
+        "pawns": [1, 1],
+        "prefs": {"label": "   A  B  C  D  E  F  G  H"},
+    },
+}
+
+Profile = tuple[tuple[str, ...], tuple[str, ...], str, str]  # fg, bg, label, bmode
+
+
+def profile_key(prefs: dict) -> Profile:
+    return (
+        tuple(prefs["fg"]),
+        tuple(prefs["bg"]),
+        prefs["label"],
+        prefs.get("bmode", "normal"),
+    )
+
+
+class CompiledProfile:
+    def __init__(self, profile: Profile):
+        """Precomputes the colored string of every piece on both square
+        colors so rendering is just lookups and joins.
+
+        :param profile: Key returned by profile_key.
+        """
+        FG, BG, self.label, bmode = profile
+        layout = BMODES.get(bmode, BMODES["normal"])
+        b_map = dict(REMAP)
+        b_map.update(layout["remap"])
+
+        # squares[bgi][piece] and the row ending variant without the last escape
+        self.squares = []
+        self.last_squares = []
+        for bgi in range(2):
+            cells = {}
+            for c in PIECES:
+                glyph = b_map[c.upper()]
+                spacing = layout["pawns" if glyph == b_map["P"] else "pieces"]
+                if c == ".":
+                    fg = BG[bgi]
+                else:
+                    fg = FG[0] if c.isupper() else FG[1]
+                cells[c] = Color(
+                    f"{' '*spacing[0]}{glyph}{' '*spacing[1]}", bg=BG[bgi], fg=fg
+                ).str
+            self.squares.append(cells)
+            self.last_squares.append({c: s[:-1] for c, s in cells.items()})
+
+
+_profiles: dict[Profile, CompiledProfile] = {}
+
+
+def compile_profile(profile: Profile) -> CompiledProfile:
+    if profile not in _profiles:
+        _profiles[profile] = CompiledProfile(profile)
+    return _profiles[profile]
+
+
+@lru_cache(maxsize=RENDER_CACHE_SIZE)
+def _render(board_fen: str, profile: Profile) -> tuple[str, ...]:
+    compiled = compile_profile(profile)
+    R = [compiled.label]
+    for r, rank in enumerate(board_fen.split("/")):
+        row = 8 - r
+        cells = []
+        for c in rank:
+            if c.isdigit():
+                cells.extend("." * int(c))
+            else:
+                cells.append(c)
+        line = []
+        for col, piece in enumerate(cells):
+            squares = compiled.last_squares if col == 7 else compiled.squares
+            line.append(squares[(r + col + 1) % 2][piece])
+        R.append(f"{row} {''.join(line)}{SEP}{row}")
+    R.append(compiled.label)
+    return tuple(R)
+
+
+def render_board(board_fen: str, prefs: dict) -> list[str]:
+    """Renders the colored UTF8 board lines.
+
+    :param board_fen: Piece placement part of a FEN.
+    :param prefs: Player preferences with fg, bg, label and bmode.
+    """
+    return list(_render(board_fen, profile_key(prefs)))
+
+
+def render_profile(board_fen: str, profile: Profile) -> list[str]:
+    """Same as render_board for an already computed profile_key."""
+    return list(_render(board_fen, profile))
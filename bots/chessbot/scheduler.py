@@ -0,0 +1,80 @@
+import asyncio
+import heapq
+import inspect
+from itertools import count
+from typing import Any, Callable, Hashable
+
+from ircbot.utils import debug, log
+
+
+class DeadlineScheduler:
+    def __init__(self):
+        """Fires callbacks at their deadline. Pending entries live in a heap
+        ordered by deadline and run sleeps until the earliest one, or forever
+        when there is nothing scheduled. Cancelled entries are dropped lazily
+        when they reach the top of the heap."""
+        self._heap: list[tuple[float, int, Hashable]] = []
+        self._entries: dict[Hashable, tuple[int, Callable, tuple]] = {}
+        self._seq = count()
+        self._wakeup = asyncio.Event()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key: Hashable):
+        return key in self._entries
+
+    def schedule(self, key: Hashable, delay: float, callback: Callable, *args: Any):
+        """Runs callback(*args) after delay seconds, replacing any entry
+        already scheduled under key.
+
+        :param key: Identifies the entry so it can be cancelled.
+        :param delay: Seconds from now.
+        :param callback: Function or coroutine function.
+        """
+        deadline = asyncio.get_running_loop().time() + delay
+        seq = next(self._seq)
+        self._entries[key] = (seq, callback, args)
+        if not self._heap or deadline < self._heap[0][0]:
+            self._wakeup.set()
+        heapq.heappush(self._heap, (deadline, seq, key))
+
+    def cancel(self, key: Hashable) -> bool:
+        return self._entries.pop(key, None) is not None
+
+    def _is_stale(self, item: tuple[float, int, Hashable]) -> bool:
+        entry = self._entries.get(item[2])
+        return entry is None or entry[0] != item[1]
+
+    def _pop_due(self, now: float) -> list[tuple[Callable, tuple]]:
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            item = heapq.heappop(self._heap)
+            if self._is_stale(item):
+                continue
+            _, callback, args = self._entries.pop(item[2])
+            due.append((callback, args))
+        return due
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            for callback, args in self._pop_due(loop.time()):
+                try:
+                    result = callback(*args)
+                    if inspect.isawaitable(result):
+                        await result
+                except Exception as e:
+                    log(f"Scheduled callback failed: {e!r}")
+
+            # Drop cancelled entries so an idle scheduler really sleeps
+            while self._heap and self._is_stale(self._heap[0]):
+                heapq.heappop(self._heap)
+
+            self._wakeup.clear()
+            timeout = self._heap[0][0] - loop.time() if self._heap else None
+            debug(f"Scheduler sleeping for {timeout} seconds")
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
@@ -0,0 +1,291 @@
+import re
+from bisect import bisect_right
+
+# Writing systems used by a single language in google_iso_lang_codes.txt
+SCRIPT_LANGS = {
+    "Grek": "el",
+    "Armn": "hy",
+    "Beng": "bn",
+    "Guru": "pa",
+    "Gujr": "gu",
+    "Orya": "or",
+    "Taml": "ta",
+    "Telu": "te",
+    "Knda": "kn",
+    "Mlym": "ml",
+    "Sinh": "si",
+    "Thai": "th",
+    "Laoo": "lo",
+    "Mymr": "my",
+    "Geor": "ka",
+    "Ethi": "am",
+    "Khmr": "km",
+    "Hang": "ko",
+    "Kana": "ja",
+    "Hani": "zh",
+}
+
+# (first code point, last code point, script), sorted
+SCRIPT_RANGES = [
+    (0x0041, 0x024F, "Latn"),
+    (0x0370, 0x03FF, "Grek"),
+    (0x0400, 0x052F, "Cyrl"),
+    (0x0530, 0x058F, "Armn"),
+    (0x0590, 0x05FF, "Hebr"),
+    (0x0600, 0x06FF, "Arab"),
+    (0x0750, 0x077F, "Arab"),
+    (0x0900, 0x097F, "Deva"),
+    (0x0980, 0x09FF, "Beng"),
+    (0x0A00, 0x0A7F, "Guru"),
+    (0x0A80, 0x0AFF, "Gujr"),
+    (0x0B00, 0x0B7F, "Orya"),
+    (0x0B80, 0x0BFF, "Taml"),
+    (0x0C00, 0x0C7F, "Telu"),
+    (0x0C80, 0x0CFF, "Knda"),
+    (0x0D00, 0x0D7F, "Mlym"),
+    (0x0D80, 0x0DFF, "Sinh"),
+    (0x0E00, 0x0E7F, "Thai"),
+    (0x0E80, 0x0EFF, "Laoo"),
+    (0x1000, 0x109F, "Mymr"),
+    (0x10A0, 0x10FF, "Geor"),
+    (0x1100, 0x11FF, "Hang"),
+    (0x1200, 0x139F, "Ethi"),
+    (0x1780, 0x17FF, "Khmr"),
+    (0x1E00, 0x1EFF, "Latn"),
+    (0x3040, 0x30FF, "Kana"),
+    (0x3130, 0x318F, "Hang"),
+    (0x3400, 0x4DBF, "Hani"),
+    (0x4E00, 0x9FFF, "Hani"),
+    (0xAC00, 0xD7AF, "Hang"),
+    (0xF900, 0xFAFF, "Hani"),
+]
+_RANGE_STARTS = [start for start, _, _ in SCRIPT_RANGES]
+
+# Frequent function words of languages sharing a script
+_WORD_LISTS = {
+    "Latn": {
+        "en": "the and is are was were you that this with have has not for what of"
+        " to it my your be do does will can but they we he she there just about"
+        " would from how why",
+        "es": "el la los las que y en un una es por con para no se lo del al como"
+        " pero más mi yo tu está eso esto muy también hay qué cómo soy eres tengo"
+        " bien gracias hola",
+        "fr": "le la les et est un une des du que qui pas ne je tu il elle nous"
+        " vous ils dans pour avec sur ce cette mais ou au aux très bien oui non"
+        " merci bonjour suis être",
+        "de": "der die das und ist nicht ich du er sie wir ihr ein eine einen zu"
+        " mit auf für von den dem des auch aber wie was noch nur sehr gut ja nein"
+        " hallo danke bin sind habe hat es",
+        "it": "il lo la gli le che e è di un una per non con sono mi ti ci si"
+        " della del questo questa ma anche come perché cosa molto ciao grazie"
+        " bene io tu lui lei noi voi",
+        "pt": "o a os as que e é de do da dos das em no na um uma para com não se"
+        " por mais mas como eu você ele ela nós isso isto muito obrigado olá está"
+        " são tem também",
+        "ro": "și si în este sunt nu da un o cu pe la de care ce că ca mai din"
+        " pentru sau dar eu tu el ea noi voi ei am ai are fost foarte bine"
+        " mulțumesc multumesc salut bună buna acest această aceasta asta aici cum"
+        " ceva să sa îmi imi acum nimic",
+        "nl": "de het een en van is dat die niet ik je jij hij zij wij we in op te"
+        " met voor zijn er maar ook als wat hoe dit naar heb hebt heeft goed ja"
+        " nee dank hallo nog wel",
+        "pl": "i w z na się nie to jest że do jak ale co tak jestem mam ma dla po"
+        " od o czy już tylko jego jej mnie ty ja my wy oni bardzo dobrze dziękuję"
+        " cześć tego tym być",
+        "cs": "a je se na v to že s z do jak ale co jsem jsi není si tak pro by od"
+        " o už jen mě ty já my vy oni velmi dobře děkuji ahoj ten ta tady proč"
+        " také",
+        "sv": "och att det som en ett är på av för med till den har inte jag du han"
+        " hon vi ni de om men så vad hur också mycket bra tack hej var kan ska"
+        " här",
+        "da": "og at det som en et er på af for med til den har ikke jeg du han hun"
+        " vi i de om men så hvad hvordan også meget godt tak hej var kan skal"
+        " her",
+        "no": "og at det som en et er på av for med til den har ikke jeg du han hun"
+        " vi dere de om men så hva hvordan også veldig bra takk hei var kan skal"
+        " her",
+        "fi": "ja on ei se että olen olet hän me te he minä sinä mitä miten kun"
+        " niin mutta tai myös tämä tuo ole oli ovat kiitos hyvä moi hei joo nyt"
+        " vain jo kuin",
+        "tr": "ve bir bu da de ne için ile çok ben sen o biz siz onlar var yok"
+        " değil mi mı mu ama gibi daha şey nasıl neden evet hayır teşekkürler"
+        " merhaba iyi şimdi kadar",
+        "id": "dan yang di ini itu dengan untuk tidak ada saya aku kamu anda dia"
+        " kami kita mereka ke dari akan sudah juga bisa apa bagaimana kenapa"
+        " terima kasih ya sangat baik halo",
+        "hu": "a az és hogy nem egy van vagy de is meg ez mi ki én te ő ti ők volt"
+        " lesz még már csak nagyon jó köszönöm szia igen mert mit hogyan",
+    },
+    "Cyrl": {
+        "ru": "и в не на я что он с как это по но ты мы вы они она так да нет все"
+        " был к у же из за то есть меня тебя очень хорошо спасибо привет почему"
+        " где сейчас",
+        "uk": "і в не на я що він з як це по але ти ми ви вони вона так та ні все"
+        " був до у же із за то є мене тебе дуже добре дякую привіт чому де"
+        " зараз",
+        "bg": "и в не на аз че той с как това по но ти ние вие те тя така да"
+        " всичко беше към от за е съм си много добре благодаря здравей защо къде"
+        " сега",
+    },
+    "Arab": {
+        "ar": "في من على إلى الى أن ان هذا هذه ما لا هو هي أنا انا أنت انت نحن"
+        " كان مع عن كل هل لم لن قد ذلك التي الذي شكرا مرحبا كيف لماذا",
+        "fa": "و در به از که این آن را با است برای من تو او ما شما آنها هم یک نه"
+        " بله چه چرا خیلی خوب ممنون سلام هست نیست می",
+        "ur": "اور میں کے کی کا ہے ہیں یہ وہ کہ سے کو نہیں ہاں آپ ہم تم کیا کیوں"
+        " بہت اچھا شکریہ تھا بھی",
+    },
+    "Hebr": {
+        "he": "של את זה זאת לא אני אתה הוא היא אנחנו הם על עם מה כן גם יש אין"
+        " אבל כי אם או רק עוד מאוד טוב תודה שלום למה איך איפה עכשיו",
+        "yi": "איך דו ער זי מיר איר זיי און איז זענען ניט נישט דער די דאס אַ אן"
+        " מיט פון פֿון צו אויף ווי וואס ווען וווּ אבער אויך שוין נאך גוט יא ניין"
+        " דאנק",
+    },
+    "Deva": {
+        "hi": "और है हैं का की के में यह वह से को नहीं हाँ मैं आप हम तुम क्या"
+        " क्यों बहुत अच्छा था भी पर",
+        "mr": "आणि आहे आहेत हे ते मी तू आम्ही तुम्ही नाही होय काय खूप चांगले होते पण या ला मध्ये",
+        "ne": "र छ छन् हो यो त्यो म तिमी हामी तपाईं होइन के किन धेरै राम्रो थियो"
+        " पनि मा लाई",
+    },
+}
+COMMON_WORDS = {
+    script: {lang: frozenset(words.split()) for lang, words in langs.items()}
+    for script, langs in _WORD_LISTS.items()
+}
+
+# Scripts where every language that uses them in google_iso_lang_codes.txt
+# has a word list, so common words alone can tell them apart
+FULLY_LISTED_SCRIPTS = {"Hebr", "Deva"}
+
+# Letters only one language in google_iso_lang_codes.txt uses
+TELLTALE_LETTERS = {
+    "ș": "ro",
+    "ț": "ro",
+    "ß": "de",
+    "ł": "pl",
+    "ř": "cs",
+    "ě": "cs",
+    "ů": "cs",
+    "ő": "hu",
+    "ű": "hu",
+    "ї": "uk",
+    "є": "uk",
+    "ђ": "sr",
+    "ћ": "sr",
+    "ѓ": "mk",
+    "ќ": "mk",
+    "ѕ": "mk",
+    "ں": "ur",
+    "ے": "ur",
+    "ٹ": "ur",
+    "ڈ": "ur",
+    "ڑ": "ur",
+    "װ": "yi",
+    "ױ": "yi",
+    "ײ": "yi",
+}
+
+# Words of listed languages that no language without a word list shares,
+# e.g. Spanish words that aren't Catalan or Galician too. Languages of a
+# script that isn't fully listed are only trusted when one of these, or one
+# of their telltale letters, shows up.
+_TELLTALE_WORDS = {
+    "en": "the you what this that with have would they there about",
+    "es": "muy también gracias hola cómo qué tengo eres",
+    "fr": "vous nous avec dans très bonjour merci oui suis être cette",
+    "de": "nicht und ich auch sehr danke habe sind ist",
+    "it": "sono questo questa molto anche della perché",
+    "pt": "você não obrigado muito também isso",
+    "ro": "foarte acum nimic sunt aici",
+    "nl": "niet heeft zijn jij bedankt",
+    "pl": "się jest jestem bardzo tylko dziękuję cześć",
+    "cs": "jsem jsi není také proč",
+    "sv": "och inte jag är mycket",
+    "da": "ikke jeg hvad meget",
+    "no": "ikke jeg hva veldig dere",
+    "fi": "että mutta myös kiitos hyvä minä sinä miten",
+    "tr": "değil için teşekkürler merhaba şimdi evet hayır nasıl çok ben",
+    "id": "bisa nggak banget gimana",
+    "hu": "hogy nagyon igen vagy köszönöm szia",
+    "ru": "что это меня тебя очень хорошо спасибо привет почему сейчас",
+    "uk": "що він дуже дякую привіт",
+    "bg": "това какво благодаря здравей защо съм",
+    "ar": "هذا هذه الذي التي ذلك لماذا مرحبا",
+    "fa": "است این برای خیلی ممنون نیست چرا",
+}
+TELLTALE_WORDS = {
+    lang: frozenset(words.split()) for lang, words in _TELLTALE_WORDS.items()
+}
+
+MIN_LETTERS = 3
+# Share of the letters that must be in the dominant script
+MIN_SCRIPT_SHARE = 0.6
+# Words and letters pointing at the best language, and how many more of them
+# than at the runner-up, to trust a guess
+MIN_EVIDENCE = 2
+MIN_LEAD = 2
+
+_SEPARATORS = re.compile(r"[\s.,;:!?¿¡\"'`()\[\]{}<>«»“”„…\-–—/|*،؛؟।]+")
+
+
+def script_of(char: str) -> str | None:
+    n = bisect_right(_RANGE_STARTS, ord(char)) - 1
+    if n >= 0 and ord(char) <= SCRIPT_RANGES[n][1]:
+        return SCRIPT_RANGES[n][2]
+    return None
+
+
+def detect(text: str) -> str | None:
+    """Language of a message when its script or common words make it evident,
+    or None when it's too short or ambiguous and a real detector must decide.
+    """
+    scripts: dict[str, int] = {}
+    letters = 0
+    for char in text:
+        if char.isalpha():
+            letters += 1
+            script = script_of(char)
+            if script:
+                scripts[script] = scripts.get(script, 0) + 1
+    if letters < MIN_LETTERS or not scripts:
+        return None
+
+    # Japanese mixes kana with Han characters
+    if "Kana" in scripts:
+        scripts["Kana"] += scripts.pop("Hani", 0)
+    script = max(scripts, key=scripts.get)
+    if scripts[script] < letters * MIN_SCRIPT_SHARE:
+        return None
+    if script in SCRIPT_LANGS:
+        return SCRIPT_LANGS[script]
+    if script not in COMMON_WORDS:
+        return None
+
+    evidence = {lang: 0 for lang in COMMON_WORDS[script]}
+    # Languages the text has telltale letters or words of
+    telltales = set()
+    for word in _SEPARATORS.split(text.lower()):
+        for lang, words in COMMON_WORDS[script].items():
+            if word in words:
+                evidence[lang] += 1
+        for lang, words in TELLTALE_WORDS.items():
+            if word in words:
+                telltales.add(lang)
+    for char in text.lower():
+        if char in TELLTALE_LETTERS:
+            lang = TELLTALE_LETTERS[char]
+            evidence[lang] = evidence.get(lang, 0) + 1
+            telltales.add(lang)
+
+    ranked = sorted(evidence.items(), key=lambda item: item[1], reverse=True)
+    best, score = ranked[0]
+    runner_up = ranked[1][1] if len(ranked) > 1 else 0
+    if score < MIN_EVIDENCE or score - runner_up < MIN_LEAD:
+        return None
+    # Otherwise it could be a relative without a word list, like Catalan
+    # for Spanish or Afrikaans for Dutch
+    if script not in FULLY_LISTED_SCRIPTS and best not in telltales:
+        return None
+    return best
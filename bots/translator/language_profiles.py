@@ -0,0 +1,67 @@
+import time
+from collections import OrderedDict
+from typing import Hashable
+
+
+class LanguageProfiles:
+    def __init__(
+        self,
+        half_life: float = 1800,
+        min_weight: float = 3,
+        min_share: float = 0.8,
+        max_weight: float = 10,
+        max_speakers: int = 10_000,
+    ):
+        """Languages each speaker wrote recently, weighted by how recent the
+        detections are. Once a speaker clearly sticks to one language it's
+        assumed without detecting again. Guesses aren't recorded, so the
+        profile fades and the speaker gets detected again every few half
+        lives.
+
+        :param half_life: Seconds after which a detection counts half.
+        :param min_weight: Decayed detections of a language needed to guess it.
+        :param min_share: Share of the speaker's detections it must have.
+        :param max_weight: Cap on the total weight of a profile, so even
+            regular speakers are detected again after a while.
+        :param max_speakers: Profiles kept, least recently used are dropped.
+        """
+        self.half_life = half_life
+        self.min_weight = min_weight
+        self.min_share = min_share
+        self.max_weight = max_weight
+        self.max_speakers = max_speakers
+        self.profiles: OrderedDict[
+            Hashable, tuple[float, dict[str, float]]
+        ] = OrderedDict()
+
+    def _decayed(self, speaker: Hashable) -> dict[str, float]:
+        if speaker not in self.profiles:
+            return {}
+        updated, weights = self.profiles[speaker]
+        factor = 0.5 ** ((time.monotonic() - updated) / self.half_life)
+        return {lang: weight * factor for lang, weight in weights.items()}
+
+    def observe(self, speaker: Hashable, lang: str):
+        weights = self._decayed(speaker)
+        weights[lang] = weights.get(lang, 0) + 1
+        total = sum(weights.values())
+        if total > self.max_weight:
+            weights = {k: w * self.max_weight / total for k, w in weights.items()}
+        # Forget languages that barely count anymore
+        weights = {k: w for k, w in weights.items() if w >= 0.05}
+        self.profiles[speaker] = (time.monotonic(), weights)
+        self.profiles.move_to_end(speaker)
+        if len(self.profiles) > self.max_speakers:
+            self.profiles.popitem(last=False)
+
+    def guess(self, speaker: Hashable) -> str | None:
+        weights = self._decayed(speaker)
+        if not weights:
+            return None
+        lang = max(weights, key=weights.get)
+        if (
+            weights[lang] >= self.min_weight
+            and weights[lang] >= sum(weights.values()) * self.min_share
+        ):
+            return lang
+        return None
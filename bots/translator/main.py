@@ -1,16 +1,22 @@
+import asyncio
 import json
 import logging
 import os
 import re
 from collections import deque
 from copy import deepcopy
+from functools import lru_cache
 from hashlib import md5
 
-from deep_translator import GoogleTranslator, single_detection
+from deep_translator import single_detection
 from dotenv import load_dotenv
 from ircbot import IrcBot, utils
 from ircbot.format import Color
 from ircbot.message import Message
+from language_detector import SCRIPT_LANGS, detect
+from language_profiles import LanguageProfiles
+from translation_cache import TranslationCache, normalize
+from translator_pool import TranslatorPool, keep_alive
 
 load_dotenv()
 
@@ -22,6 +28,13 @@ NICK = os.getenv("NICK") or "_bqbot"
 PASSWORD = os.getenv("PASSWORD") or ""
 CHANNELS = json.loads(os.getenv("CHANNELS") or "[]")
 DETECTED_LANG_API_KEY = os.getenv("DETECTED_LANG_API_KEY")
+# Maximum number of requests to the translation provider in flight at once
+TRANSLATE_CONCURRENCY = int(os.getenv("TRANSLATE_CONCURRENCY") or 8)
+# Seconds a cached translation is reused
+CACHE_TTL = float(os.getenv("CACHE_TTL") or 3600)
+# Idle translator clients kept for reuse, and for how many seconds
+MAX_IDLE_TRANSLATORS = int(os.getenv("MAX_IDLE_TRANSLATORS") or 32)
+TRANSLATOR_IDLE_TIMEOUT = float(os.getenv("TRANSLATOR_IDLE_TIMEOUT") or 300)
 
 ACCEPT_PRIVATE_MESSAGES = True
 DBFILEPATH = NICK + ".db"
@@ -61,6 +74,7 @@ INFO_CMDS = {
         "@babel: automatically translate a chat and sends every message to you as a PM. Use '@help babel' for more info.",
         "@back: Translates a recent user message. Usate '@help back' for more info.",
         "@reset: resets your babel preferences",
+        "@cache: shows how often translations are served from the cache",
     ],
     #    r"^(.*) linux ": "Do you mean the best OS?",
     #    r"^(.*) vim ": "Do you mean the best Text editor???",
@@ -69,7 +83,48 @@ INFO_CMDS = {
 LANGS = [lng.strip() for lng in open("google_iso_lang_codes.txt").readlines()]
 LANG_ALIASES = {"zh": "zh-CN"}
 
-# Translator will be initialized per request since deep-translator doesn't maintain state
+# deep-translator is blocking, so its calls run in threads, a few at a time
+provider_slots = asyncio.Semaphore(TRANSLATE_CONCURRENCY)
+keep_alive(TRANSLATE_CONCURRENCY)
+translator_pool = TranslatorPool(MAX_IDLE_TRANSLATORS, TRANSLATOR_IDLE_TIMEOUT)
+
+
+async def provider_call(func, *args, **kwargs):
+    async with provider_slots:
+        return await asyncio.to_thread(func, *args, **kwargs)
+
+
+translation_cache = TranslationCache(CACHE_SIZE, CACHE_TTL)
+detection_cache = TranslationCache(CACHE_SIZE, CACHE_TTL)
+# Languages each (channel, nick) usually writes in
+language_profiles = LanguageProfiles()
+
+
+async def detect_language(text: str, speaker: tuple[str, str] | None = None) -> str:
+    """Asks the local detector, then the speaker's profile and only then the
+    remote detector. Remote detections and local ones from a script a single
+    language uses update the profile, so a local guess that turns out wrong
+    can't spread to the speaker's ambiguous lines. Every translation of a
+    message shares one detection."""
+
+    async def detect_and_learn() -> str:
+        lang = detect(text)
+        learn = lang in SCRIPT_LANGS.values()
+        if lang is None and speaker is not None:
+            guess = language_profiles.guess(speaker)
+            if guess is not None:
+                return guess
+        if lang is None:
+            lang = await provider_call(
+                single_detection, text, api_key=DETECTED_LANG_API_KEY
+            )
+            learn = True
+        if lang and learn and speaker is not None:
+            language_profiles.observe(speaker, lang)
+        return lang
+
+    return await detection_cache.get((text, speaker), detect_and_learn)
+
 
 # Initialize bot
 bot = IrcBot(HOST, PORT, NICK, CHANNELS, PASSWORD, use_ssl=SSL)
@@ -89,7 +144,13 @@ for r in INFO_CMDS:
         return INFO_CMDS[regexp]
 
 
-async def trans(m, dst: str, src: str = "auto", autodetect: bool = True) -> str:
+async def trans(
+    m,
+    dst: str,
+    src: str = "auto",
+    autodetect: bool = True,
+    speaker: tuple[str, str] | None = None,
+) -> str:
     if not isinstance(m, str):
         m = m.group(1)
 
@@ -100,14 +161,16 @@ async def trans(m, dst: str, src: str = "auto", autodetect: bool = True) -> str:
     if match is None:
         return "Could not parse source and destination languages"
     head = match[1] if match[1] else ""
-    m = match[2]
+    text = match[2]
+    # Whitespace only matters to the cache key, the provider gets the text as typed
+    m = normalize(text)
 
     logging.info("Translating: " + m)
     try:
         # Detect language if needed
         if autodetect:
             try:
-                detected_lang = single_detection(m, api_key=DETECTED_LANG_API_KEY)
+                detected_lang = await detect_language(m, speaker)
                 if detected_lang == dst:
                     logging.info("1. Ignoring source equals destination: " + m)
                     logging.info(f"Source: {detected_lang}  Destination: {dst}")
@@ -120,13 +183,13 @@ async def trans(m, dst: str, src: str = "auto", autodetect: bool = True) -> str:
                 logging.warning(f"Language detection failed: {e}")
                 # Continue with translation anyway
 
-        # Create translator instance
-        if src == "auto":
-            translator = GoogleTranslator(target=dst)
-        else:
-            translator = GoogleTranslator(source=src, target=dst)
+        def translate_text() -> str:
+            with translator_pool.client(src, dst) as translator:
+                return translator.translate(text)
 
-        translated_text = translator.translate(m)
+        translated_text = await translation_cache.get(
+            (m, src, dst), lambda: provider_call(translate_text)
+        )
         return head + str(translated_text)
     except Exception as e:
         return str(e)
@@ -135,7 +198,9 @@ async def trans(m, dst: str, src: str = "auto", autodetect: bool = True) -> str:
 async def translate(
     m, message: Message, dst: str, src: str = "auto", autodetect: bool = True
 ) -> Message | None:
-    translated_msg = await trans(m, dst, src, autodetect)
+    translated_msg = await trans(
+        m, dst, src, autodetect, speaker=(message.channel, message.nick)
+    )
     if translated_msg:
         return Message(
             message=f"  <{message.sender_nick} ({dst.upper()})> {translated_msg}",
@@ -258,7 +323,9 @@ async def back(m, message: Message) -> str | Message:
     if len(cached) < n:
         return f"<{message.nick}> There are only {len(cached)} messages for {nick} on this channel"
     text = cached[-n]
-    translated_msg = await trans(text, dst, "auto") or text
+    translated_msg = (
+        await trans(text, dst, "auto", speaker=(message.channel, nick)) or text
+    )
     return Message(
         message=f"  <{message.sender_nick} ({dst.upper()})> {translated_msg}",
         channel=message.channel,
@@ -323,6 +390,7 @@ COLORS = [
 ]
 
 
+@lru_cache(maxsize=CACHE_SIZE)
 def colorize(text: str) -> str:
     # use hash and colors to colorize text
     _hash = int(md5(text.strip().encode()).hexdigest(), 16)
@@ -330,18 +398,19 @@ def colorize(text: str) -> str:
 
 
 async def babel_message(
-    m, message: Message, babel_nick: str, dst: str, src: str = "auto"
-) -> Message:
+    m, message: Message, babel_nicks: list[str], dst: str, src: str = "auto"
+) -> list[Message]:
+    """Translates once for every babel user that reads in dst."""
     if not isinstance(m, str):
         m = m.group(1)
-    translated_msg = await trans(m, dst, src)
+    translated_msg = await trans(m, dst, src, speaker=(message.channel, message.nick))
     if not translated_msg:
         translated_msg = m
-    return Message(
-        message=f"  \x02({colorize(message.channel)}) <{colorize(message.nick)}>\x02 {translated_msg}",
-        channel=babel_nick,
-        is_private=True,
-    )
+    text = f"  \x02({colorize(message.channel)}) <{colorize(message.nick)}>\x02 {translated_msg}"
+    return [
+        Message(message=text, channel=babel_nick, is_private=True)
+        for babel_nick in babel_nicks
+    ]
 
 
 async def ask(
@@ -369,6 +438,15 @@ async def ask(
     return resp.get("text").strip() if resp else None
 
 
+@bot.regex_cmd_with_message("^@cache$", ACCEPT_PRIVATE_MESSAGES)
+def cache_stats(m, message: Message) -> list[str]:
+    return [
+        f"<{message.nick}> Translation cache: {translation_cache.stats()}",
+        f"<{message.nick}> Detection cache: {detection_cache.stats()}",
+        f"<{message.nick}> Translator clients: {translator_pool.stats()}",
+    ]
+
+
 @bot.regex_cmd_with_message("^@reset$", ACCEPT_PRIVATE_MESSAGES)
 def reset_babel(m, message: Message) -> Message:
     global babel_prefs
@@ -417,6 +495,7 @@ async def process_auto(m, message: Message) -> None:
 
     # Send translations for babel users of this channel
     BABEL_WARN_THRESHOLD = 5
+    babel_nicks_by_dst: dict[str, list[str]] = {}
     for babel_nick in deepcopy(babel_users[message.channel]):
         babel_users[message.channel][babel_nick]["counter"] += 1
         dst = babel_users[message.channel][babel_nick]["dst"]
@@ -447,18 +526,15 @@ async def process_auto(m, message: Message) -> None:
                 )
             )
 
-        future_translations.append(
-            babel_message(
-                m,
-                message,
-                babel_nick,
-                dst,
-            )
-        )
+        babel_nicks_by_dst.setdefault(dst, []).append(babel_nick)
+
+    future_translations.extend(
+        babel_message(m, message, babel_nicks, dst)
+        for dst, babel_nicks in babel_nicks_by_dst.items()
+    )
 
-    # TODO: When upgrading to new re-ircbot just use asyncio.as_completed
-    # for future in asyncio.as_completed(future_translations):
-    for future in future_translations:
+    # Translations run concurrently and are sent as soon as each one is ready
+    for future in asyncio.as_completed(future_translations):
         try:
             result = await future
             await bot.send_message(result)
@@ -560,7 +636,7 @@ async def process_auto(m, message: Message) -> None:
                 nick,
             )
 
-        msg = await trans(m, dst=babel_prefs[nick]["dst"])
+        msg = await trans(m, dst=babel_prefs[nick]["dst"], speaker=(nick, nick))
         msg = msg if msg else m[1]
         await bot.send_message(
             f" \x02<{nick}>\x02 {msg}",
@@ -0,0 +1,64 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Hashable
+
+
+def normalize(text: str) -> str:
+    """Collapses whitespace so trivially different lines share a cache entry."""
+    return " ".join(text.split())
+
+
+class TranslationCache:
+    def __init__(self, maxsize: int = 1024, ttl: float = 3600):
+        """LRU cache of provider results whose entries expire after ttl seconds.
+        Concurrent requests for a key that is being computed wait for that
+        single computation instead of starting their own.
+
+        :param maxsize: Maximum number of results kept.
+        :param ttl: Seconds a result stays valid.
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries: OrderedDict[Hashable, tuple[float, str]] = OrderedDict()
+        self.pending: dict[Hashable, asyncio.Task] = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    async def get(self, key: Hashable, compute: Callable[[], Awaitable[str]]) -> str:
+        entry = self.entries.get(key)
+        if entry is not None:
+            expires, value = entry
+            if expires > time.monotonic():
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return value
+            del self.entries[key]
+
+        task = self.pending.get(key)
+        if task is None:
+            self.misses += 1
+            task = asyncio.ensure_future(compute())
+            self.pending[key] = task
+            task.add_done_callback(lambda done: self._store(key, done))
+        else:
+            self.coalesced += 1
+        # A cancelled caller must not cancel the computation others wait on
+        return await asyncio.shield(task)
+
+    def _store(self, key: Hashable, task: asyncio.Task):
+        del self.pending[key]
+        if task.cancelled() or task.exception() is not None:
+            return
+        self.entries[key] = (time.monotonic() + self.ttl, task.result())
+        if len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def stats(self) -> str:
+        lookups = self.hits + self.misses + self.coalesced
+        rate = (self.hits + self.coalesced) / lookups if lookups else 0
+        return (
+            f"{self.hits} hits, {self.misses} misses, {self.coalesced} coalesced"
+            f" ({rate:.0%} hit rate), {len(self.entries)}/{self.maxsize} entries"
+        )
@@ -0,0 +1,95 @@
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import requests
+from deep_translator import GoogleTranslator
+from deep_translator import google as google_module
+from requests.adapters import HTTPAdapter
+
+
+def keep_alive(pool_size: int) -> requests.Session:
+    """deep-translator calls requests.get for every translation, opening a new
+    connection each time. Routes those calls through one session so
+    connections to Google are reused.
+
+    :param pool_size: Connections kept open per host, one per concurrent
+        translation.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    google_module.requests = session
+    return session
+
+
+class TranslatorPool:
+    def __init__(self, max_idle: int = 32, idle_timeout: float = 300):
+        """Reuses GoogleTranslator clients per (source, target) instead of
+        building one per translation. A client keeps the request parameters
+        of the text it's translating, so each one is used by a single thread
+        at a time. Safe to use from worker threads.
+
+        :param max_idle: Maximum number of idle clients kept, least recently
+            used are dropped first.
+        :param idle_timeout: Seconds an idle client is kept.
+        """
+        self.max_idle = max_idle
+        self.idle_timeout = idle_timeout
+        self.idle: OrderedDict[tuple[str, str], list] = OrderedDict()
+        self.idle_count = 0
+        self.created = 0
+        self.reused = 0
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def client(self, source: str, target: str):
+        key = (source, target)
+        translator = self._acquire(key)
+        try:
+            yield translator
+        finally:
+            self._release(key, translator)
+
+    def _acquire(self, key: tuple[str, str]) -> GoogleTranslator:
+        with self._lock:
+            clients = self.idle.get(key)
+            if clients:
+                _, translator = clients.pop()
+                self.idle_count -= 1
+                if not clients:
+                    del self.idle[key]
+                self.reused += 1
+                return translator
+            self.created += 1
+        source, target = key
+        return GoogleTranslator(source=source, target=target)
+
+    def _release(self, key: tuple[str, str], translator: GoogleTranslator):
+        now = time.monotonic()
+        with self._lock:
+            self.idle.setdefault(key, []).append((now, translator))
+            self.idle.move_to_end(key)
+            self.idle_count += 1
+            for other in list(self.idle):
+                clients = self.idle[other]
+                fresh = [c for c in clients if now - c[0] < self.idle_timeout]
+                self.idle_count -= len(clients) - len(fresh)
+                if fresh:
+                    self.idle[other] = fresh
+                else:
+                    del self.idle[other]
+            while self.idle_count > self.max_idle:
+                oldest, clients = next(iter(self.idle.items()))
+                clients.pop(0)
+                self.idle_count -= 1
+                if not clients:
+                    del self.idle[oldest]
+
+    def stats(self) -> str:
+        return (
+            f"{self.created} created, {self.reused} reused,"
+            f" {self.idle_count}/{self.max_idle} idle"
+        )